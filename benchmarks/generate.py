@@ -0,0 +1,158 @@
+"""
+Deterministic synthetic inputs for the benchmarks, in the same layout as the
+real exports:
+
+    {year}.csv, {year}-web.csv  YoY comps social/web data (mc_yoy_comps)
+    promos.csv                  promo calendar (mc_yoy_comps)
+    data.csv                    Jordan creative-level export (jordan_reporting)
+
+The same seed and sizes always produce the same files. Rows are written in
+chunks, so anything from 1k to 50M rows fits in memory.
+
+    python benchmarks/generate.py OUT_DIR --rows 1000000 --year 2025
+"""
+import argparse
+import datetime
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+PLATFORMS = ['meta', 'snap', 'tiktok', 'pinterest', 'reddit', 'youtube', 'x', 'linkedin']
+CAMPAIGN_TYPES = ['dynamic', 'promo', 'brand', 'prospecting', 'retargeting', 'launch']
+AUDIENCES = ['mens_18+', 'womens_18+', 'kids', 'jordan', 'running', 'basketball']
+FOPS = ['sport', 'streetwear', 'kids', 'womens', 'golf']
+CHUNK_ROWS = 1_000_000
+
+def _rng(seed: int, name: str) -> np.random.Generator:
+    # Each file gets its own stream, so changing one file's size doesn't change the others
+    return np.random.default_rng([seed, zlib.crc32(name.encode())])
+
+def campaign_names(n_campaigns: int, rng: np.random.Generator) -> np.ndarray:
+    types = rng.choice(CAMPAIGN_TYPES, n_campaigns)
+    audiences = rng.choice(AUDIENCES, n_campaigns)
+    return np.array([f"FY_{t}_{a}_{i:05d}" for i, (t, a) in enumerate(zip(types, audiences))])
+
+def write_yoy_csv(path: str, year: int, rows: int, web: bool = False, seed: int = 0,
+                  n_campaigns: int = 500, platforms: list[str] = PLATFORMS) -> None:
+    """
+    Writes a {year}.csv (or {year}-web.csv with web=True) of `rows` rows spread
+    over August 1 to December 31 of the year.
+    """
+    rng = _rng(seed, os.path.basename(path))
+    start = datetime.date(year, 8, 1)
+    days = (datetime.date(year, 12, 31) - start).days + 1
+    date_strings = np.array([(start + datetime.timedelta(days=d)).strftime("%m/%d/%Y") for d in range(days)])
+    campaigns = campaign_names(n_campaigns, rng)
+    campaign_platforms = rng.choice(platforms, n_campaigns)
+    if web:
+        demand, orders, visits = "adobe_revenue", "adobe_orders", "adobe_visits"
+    else:
+        demand, orders, visits = ("lc_demand_digital_web_app_adobe", "lc_orders_digital_web_app_adobe",
+                                  "lc_visits_digital_web_app_adobe")
+
+    written = 0
+    while written < rows:
+        n = min(CHUNK_ROWS, rows - written)
+        campaign = rng.integers(0, n_campaigns, n)
+        chunk = pd.DataFrame({
+            "date_day": date_strings[rng.integers(0, days, n)],
+            "platform": campaign_platforms[campaign],
+            "campaign_name": campaigns[campaign],
+            "media_spend": rng.gamma(2.0, 150.0, n).round(2),
+            "impressions": rng.integers(1_000, 200_000, n),
+            "clicks": rng.integers(5, 2_000, n),
+            demand: rng.gamma(2.0, 600.0, n).round(2),
+            orders: rng.integers(0, 60, n),
+            visits: rng.integers(20, 4_000, n),
+        })
+        chunk.to_csv(path, mode="w" if written == 0 else "a", header=written == 0, index=False)
+        written += n
+
+def write_promos(path: str, years: list[int], seed: int = 0, per_year: int = 12) -> None:
+    """
+    Writes a promos.csv with `per_year` promos of 1-14 days in each year's Q4.
+    """
+    rng = _rng(seed, os.path.basename(path))
+    rows = []
+    for year in years:
+        for i in range(per_year):
+            start = datetime.date(year, 10, 1) + datetime.timedelta(days=int(rng.integers(0, 85)))
+            end = start + datetime.timedelta(days=int(rng.integers(0, 14)))
+            rows.append({"Promo Name": f"Promo {year}-{i:02d}", "Start Date": start.strftime("%m/%d/%y"),
+                         "End Date": end.strftime("%m/%d/%y")})
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+def _money(values: np.ndarray) -> list[str]:
+    return [f"${v:,.2f}" for v in values]
+
+def _count(values: np.ndarray) -> list[str]:
+    return [f"{v:,}" for v in values]
+
+def write_jordan(path: str, weeks: list[int], rows: int, seed: int = 0, creatives_per_fop: int = 40) -> None:
+    """
+    Writes a Jordan data.csv with about `rows` creative-level rows split evenly
+    over the given retail weeks and FOPS, in the export's pivot layout: group
+    labels only on the first row of each group, plus fop and week "Total" rows.
+    """
+    rng = _rng(seed, os.path.basename(path))
+    per_fop = max(rows // (len(weeks) * len(FOPS)), 1)
+    header = True
+    for week in weeks:
+        for fop_i, fop in enumerate(FOPS):
+            n = per_fop
+            creatives = np.array(['dynamic'] + [f"{fop}_creative_{i:03d}" for i in range(creatives_per_fop)])
+            creative = np.sort(rng.integers(0, len(creatives), n))
+            spend = rng.gamma(2.0, 800.0, n)
+            demand = np.where(rng.random(n) < 0.1, 0.0, rng.gamma(2.0, 3_000.0, n))
+            impressions = rng.integers(10_000, 900_000, n)
+            clicks = rng.integers(100, 9_000, n)
+            visits = rng.integers(50, 5_000, n)
+            opens = rng.integers(0, 800, n)
+            first_of_creative = np.r_[True, creative[1:] != creative[:-1]]
+            chunk = pd.DataFrame({
+                "retail_week": [str(week) if fop_i == 0 and i == 0 else "" for i in range(n)],
+                "fop": [fop] + [""] * (n - 1),
+                "cp_general_creative_name": np.where(first_of_creative, creatives[creative], ""),
+                "Media Spend": _money(spend),
+                "ROAS": _money(demand / spend),
+                "CPV": _money(spend / (visits + opens)),
+                "CTR": [f"{v:.2f}%" for v in clicks / impressions * 100],
+                "Demand": _money(demand),
+                "Impressions": _count(impressions),
+                "Clicks": _count(clicks),
+                "Visits (Adobe)": _count(visits),
+                "Opens (App)": _count(opens),
+            })
+            total = {col: "" for col in chunk.columns} | {"fop": f"{fop} Total", "Media Spend": "$1.00", "CTR": "1.00%"}
+            chunk = pd.concat([chunk, pd.DataFrame([total])])
+            chunk.to_csv(path, mode="w" if header else "a", header=header, index=False)
+            header = False
+        week_total = pd.DataFrame([{"retail_week": f"{week} Total", "Media Spend": "$1.00", "CTR": "1.00%"}],
+                                  columns=chunk.columns)
+        week_total.to_csv(path, mode="a", header=False, index=False)
+
+def generate(out_dir: str, rows: int, year: int, seed: int = 0, jordan_rows: int | None = None,
+             n_campaigns: int = 500, jordan_weeks: list[int] | None = None) -> None:
+    """
+    Writes every input for this year and last year into out_dir.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for y in (year, year - 1):
+        write_yoy_csv(os.path.join(out_dir, f"{y}.csv"), y, rows, web=False, seed=seed, n_campaigns=n_campaigns)
+        write_yoy_csv(os.path.join(out_dir, f"{y}-web.csv"), y, rows, web=True, seed=seed, n_campaigns=n_campaigns)
+    write_promos(os.path.join(out_dir, "promos.csv"), [year - 1, year], seed=seed)
+    write_jordan(os.path.join(out_dir, "data.csv"), jordan_weeks or list(range(1, 53)),
+                 jordan_rows if jordan_rows is not None else rows, seed=seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write deterministic synthetic inputs for the benchmarks.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows per YoY csv")
+    parser.add_argument("--jordan-rows", type=int, default=None, help="rows in data.csv (default: --rows)")
+    parser.add_argument("--year", type=int, default=datetime.date.today().year)
+    parser.add_argument("--campaigns", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.rows, args.year, args.seed, args.jordan_rows, args.campaigns)
@@ -0,0 +1,172 @@
+"""
+Local mock of the parts of the Snapchat Ads API the bidder uses:
+
+    POST /login/oauth2/access_token             token exchange/refresh
+    GET  /v1/adsquads/{id}                      one ad squad
+    GET  /v1/campaigns/{id}/adsquads            ad squads in a campaign (paged)
+    GET  /v1/adaccounts/{id}/adsquads           ad squads in an ad account (paged)
+    PUT  /v1/campaigns/{id}/adsquads            bulk ad squad update
+
+Ad squads are generated deterministically. Optional latency and 429 injection
+make it usable for rate-limit and concurrency benchmarks.
+
+    python benchmarks/mock_ads_api.py --port 8765 --squads 5000
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockAdsAPI:
+    """
+    Runs the mock on a background thread. `base_url` is the value to pass as
+    api_base; `calls` counts requests by method.
+    """
+    def __init__(self, n_squads=1000, n_campaigns=20, latency=0.0, throttle_rate=0.0, seed=0, port=0):
+        self.squads = {
+            f"sq-{i:06d}": {
+                "id": f"sq-{i:06d}",
+                "campaign_id": f"camp-{i % n_campaigns:04d}",
+                "bid_micro": 1_000_000 + (i % 50) * 10_000,
+                "bid_strategy": "LOWEST_COST_WITH_MAX_BID",
+                "updated_at": "2025-01-01T00:00:00.000Z",
+            }
+            for i in range(n_squads)
+        }
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = {"GET": 0, "PUT": 0, "POST": 0}
+        self.version = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    @property
+    def token_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/login/oauth2/access_token"
+
+    def start(self) -> "MockAdsAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                data = b"" if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _start(self, method) -> bool:
+                with api._lock:
+                    api.calls[method] += 1
+                    throttled = api._random.random() < api.throttle_rate
+                if api.latency:
+                    time.sleep(api.latency)
+                if throttled:
+                    self._send(429, {"request_status": "ERROR", "display_message": "rate limited"}, {"Retry-After": "1"})
+                return not throttled
+
+            def do_POST(self):
+                if not self._start("POST"):
+                    return
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._send(200, {"access_token": f"mock-{time.time_ns()}", "refresh_token": "mock-refresh",
+                                 "expires_in": 1800, "token_type": "Bearer"})
+
+            def do_GET(self):
+                if not self._start("GET"):
+                    return
+                url = urllib.parse.urlsplit(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                if m := re.fullmatch(r"/v1/adsquads/([^/]+)", url.path):
+                    adsquad = api.squads.get(m.group(1))
+                    if adsquad is None:
+                        return self._send(404, {"request_status": "ERROR", "display_message": "not found"})
+                    return self._send(200, {"request_status": "SUCCESS", "adsquads": [
+                        {"sub_request_status": "SUCCESS", "adsquad": adsquad}]})
+                if m := re.fullmatch(r"/v1/(campaigns|adaccounts)/([^/]+)/adsquads", url.path):
+                    kind, parent = m.groups()
+                    limit = int(query.get("limit", ["1000"])[0])
+                    cursor = int(query.get("cursor", ["0"])[0])
+                    etag = f'"{api.version}-{kind}-{parent}-{cursor}-{limit}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(304, headers={"ETag": etag})
+                    squads = [s for s in api.squads.values() if kind == "adaccounts" or s["campaign_id"] == parent]
+                    body = {"request_status": "SUCCESS",
+                            "adsquads": [{"sub_request_status": "SUCCESS", "adsquad": s}
+                                         for s in squads[cursor:cursor + limit]],
+                            "paging": {}}
+                    if cursor + limit < len(squads):
+                        body["paging"]["next_link"] = (
+                            f"{api.base_url}/{kind}/{parent}/adsquads?limit={limit}&cursor={cursor + limit}")
+                    return self._send(200, body, {"ETag": etag})
+                self._send(404, {"request_status": "ERROR"})
+
+            def do_PUT(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self._start("PUT"):
+                    return
+                if not re.fullmatch(r"/v1/campaigns/([^/]+)/adsquads", urllib.parse.urlsplit(self.path).path):
+                    return self._send(404, {"request_status": "ERROR"})
+                subs = []
+                with api._lock:
+                    api.version += 1
+                    now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+                    for adsquad in body.get("adsquads", []):
+                        if adsquad.get("id") not in api.squads:
+                            subs.append({"sub_request_status": "ERROR", "sub_request_error_reason": "not found"})
+                            continue
+                        api.squads[adsquad["id"]] = dict(adsquad, updated_at=now)
+                        subs.append({"sub_request_status": "SUCCESS", "adsquad": api.squads[adsquad["id"]]})
+                self._send(200, {"request_status": "SUCCESS", "adsquads": subs})
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock Snapchat Ads API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--squads", type=int, default=1000)
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+    api = MockAdsAPI(args.squads, args.campaigns, args.latency, args.throttle_rate, port=args.port).start()
+    print(f"Mock Ads API on {api.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
@@ -0,0 +1,261 @@
+"""
+Times and memory-profiles each stage of the three automations on synthetic
+data, and saves the results as JSON so runs can be compared.
+
+    python benchmarks/run.py --rows 1000000
+    python benchmarks/run.py --rows 1000000 --suites yoy,jordan --compare benchmarks/results/<earlier>.json
+
+Inputs are generated into --data-dir (reused if already there for the same
+sizes and seed). Each run is written to --results-dir as <timestamp>.json and
+compared against --compare, or the most recent earlier result with the same
+sizes; stages more than --threshold slower are flagged.
+
+--trace-memory adds each stage's peak Python allocation (tracemalloc), but
+tracing slows pandas-heavy stages several times over, so traced runs are only
+compared with other traced runs.
+"""
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+for subdir in ("mc_yoy_comps", "jordan_reporting", "snapchat_bid_micros"):
+    sys.path.insert(0, os.path.join(ROOT, subdir))
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+from generate import generate  # noqa: E402
+from common.instrument import count_rows, peak_rss_mb, rss_mb  # noqa: E402
+
+class Harness:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    def measure(self, name, fn, *args, rows_in=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) as the stage `name`, recording wall and CPU time,
+        tracemalloc peak, RSS, and rows in/out. Returns fn's result.
+        """
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.stages.append({
+            "stage": name,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "peak_alloc_mb": None if peak is None else round(peak, 3),
+            "rss_mb": round(rss_mb(), 3),
+            "peak_rss_mb": round(peak_rss_mb(), 3),
+            "rows_in": rows_in,
+            "rows_out": count_rows(result),
+        })
+        print(f"  {name:<40} {wall:9.3f}s wall {cpu:9.3f}s cpu"
+              + ("" if peak is None else f" {peak:9.1f}MB peak alloc"), flush=True)
+        return result
+
+def run_yoy(h: Harness, year: int, rows: int, workers: int) -> None:
+    import process
+    from frame_cache import CACHE_DIR
+
+    raw = h.measure("yoy.load_df", process.load_df, f"{year}", rows_in=rows)
+    df = h.measure("yoy.prepare_df", process.prepare_df, raw, rows_in=len(raw))
+    raw_web = h.measure("yoy.load_df(web)", process.load_df, f"{year}-web", rows_in=rows)
+    h.measure("yoy.prepare_web_df", process.prepare_web_df, raw_web, rows_in=len(raw_web))
+    del raw, raw_web
+
+    sources = [
+        (f"{year}", process.prepare_df, "social"),
+        (f"{year - 1}", process.prepare_df, "social"),
+        (f"{year}-web", process.prepare_web_df, "web"),
+        (f"{year - 1}-web", process.prepare_web_df, "web"),
+    ]
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    h.measure("yoy.load_sources(cold cache)", process.load_sources, sources, rows_in=4 * rows)
+    all_df = h.measure("yoy.load_sources(warm cache)", process.load_sources, sources, rows_in=4 * rows)
+    if workers > 1:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        h.measure(f"yoy.load_sources({workers} workers, cold cache)", process.load_sources, sources, workers,
+                  rows_in=4 * rows)
+
+    h.measure("yoy.aggregate_by_day", process.aggregate_by_day, df, process.kpis, rows_in=len(df))
+    h.measure("yoy.aggregate_by_week", process.aggregate_by_week, df, process.kpis, rows_in=len(df))
+    h.measure("yoy.aggregate_slices", process.aggregate_slices, all_df, process.slices, process.kpis,
+              rows_in=len(all_df))
+
+def run_jordan(h: Harness, rows: int) -> None:
+    import parse_data
+
+    h.measure("jordan.read_report(latest 2 weeks)", parse_data.read_report, "data.csv", rows_in=rows)
+    df = h.measure("jordan.read_report(all weeks)", parse_data.read_report, "data.csv", n_weeks=None, rows_in=rows)
+    h.measure("jordan.build_report", parse_data.build_report, df, rows_in=len(df))
+
+def run_snapchat(h: Harness, n_squads: int, api_rate: float) -> None:
+    import async_client
+    import bid_engine
+    import flask_server
+    import update_bid
+    from mock_ads_api import MockAdsAPI
+    from scheduler import RequestScheduler
+
+    flask_server.token_manager.set({"access_token": "bench", "refresh_token": "bench", "expires_in": 3600,
+                                    "obtained_at": int(time.time())})
+    if os.path.exists(update_bid.SNAPSHOT_PATH):
+        os.remove(update_bid.SNAPSHOT_PATH)
+    with MockAdsAPI(n_squads=n_squads) as api:
+        ids = list(api.squads)
+        bids = [(adsquad_id, 1 + i % 100 / 100) for i, adsquad_id in enumerate(ids)]
+        # mostly-unchanged sheet: only every 10th bid moves
+        sheet = [(adsquad_id, api.squads[adsquad_id]["bid_micro"] / 1e6 + (0.05 if i % 10 == 0 else 0))
+                 for i, adsquad_id in enumerate(ids)]
+
+        scheduler = RequestScheduler(rate=api_rate, max_rate=api_rate)
+        h.measure("snapchat.update_adsquad_bids", update_bid.update_adsquad_bids, bids,
+                  concurrency=32, api_base=api.base_url, scheduler=scheduler, rows_in=n_squads)
+        h.measure("snapchat.sync_adsquad_bids(cold)", update_bid.sync_adsquad_bids, sheet, ad_account_id="bench",
+                  concurrency=32, api_base=api.base_url, scheduler=scheduler, rows_in=n_squads)
+        h.measure("snapchat.sync_adsquad_bids(warm)", update_bid.sync_adsquad_bids, sheet, ad_account_id="bench",
+                  concurrency=32, api_base=api.base_url, scheduler=scheduler, rows_in=n_squads)
+        # a repricing cycle: compute the new bids from a week of per-squad rows, then push them
+        rng = np.random.default_rng(0)
+        perf = pd.DataFrame({
+            "adsquad_id": np.repeat(ids, 7),
+            "spend": rng.gamma(2, 10, 7 * n_squads),
+            "impressions": rng.integers(1, 20_000, 7 * n_squads),
+            "orders": rng.poisson(0.5, 7 * n_squads),
+            "demand": rng.gamma(2, 30, 7 * n_squads),
+        })
+        current = bid_engine.snapshot_bids(update_bid.load_snapshot())
+        summed = h.measure("snapchat.summarize_performance", bid_engine.summarize_performance, perf, current,
+                           rows_in=len(perf))
+        plan = h.measure("snapchat.compute_bids", bid_engine.compute_bids, summed, bid_engine.BidRules(target_roas=3),
+                         rows_in=n_squads)
+        h.measure("snapchat.sync_adsquad_bids(computed)", update_bid.sync_adsquad_bids, bid_engine.bid_sheet(plan),
+                  ad_account_id="bench", concurrency=32, api_base=api.base_url, scheduler=scheduler, rows_in=n_squads)
+        h.measure("snapchat.async update_adsquad_bids", async_client.run_sync, "update_adsquad_bids", bids,
+                  api_base=api.base_url, scheduler=scheduler, rows_in=n_squads)
+        h.stages[-1]["api_calls"] = dict(api.calls)
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current: dict, previous: dict, threshold: float) -> None:
+    """
+    Prints each stage's wall time against a previous run, flagging regressions.
+    """
+    before = {s["stage"]: s for s in previous["stages"]}
+    print(f"\nCompared with {previous['meta']['timestamp']} ({previous['meta'].get('commit')}):")
+    for stage in current["stages"]:
+        old = before.get(stage["stage"])
+        if not old or not old["wall_s"]:
+            continue
+        ratio = stage["wall_s"] / old["wall_s"]
+        flag = "  REGRESSION" if ratio > 1 + threshold else ""
+        print(f"  {stage['stage']:<40} {old['wall_s']:9.3f}s -> {stage['wall_s']:9.3f}s ({ratio:5.2f}x){flag}")
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the YoY comps, Jordan and Snapchat pipelines.")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows per YoY csv")
+    parser.add_argument("--jordan-rows", type=int, default=None, help="rows in data.csv (default: --rows)")
+    parser.add_argument("--squads", type=int, default=2_000, help="ad squads on the mock Ads API")
+    parser.add_argument("--api-rate", type=float, default=1_000.0, help="requests/second allowed against the mock")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes for the parallel YoY load")
+    parser.add_argument("--year", type=int, default=datetime.date.today().year)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suites", default="yoy,jordan,snapchat")
+    parser.add_argument("--data-dir", default=None, help="where inputs are generated (default: a dir per size)")
+    parser.add_argument("--results-dir", default=os.path.join(HERE, "results"))
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown flagged as a regression")
+    parser.add_argument("--trace-memory", action="store_true", help="record peak allocations (slows every stage)")
+    args = parser.parse_args(argv)
+
+    jordan_rows = args.jordan_rows if args.jordan_rows is not None else args.rows
+    data_dir = os.path.abspath(args.data_dir or os.path.join(
+        HERE, ".data", f"rows{args.rows}-jordan{jordan_rows}-year{args.year}-seed{args.seed}"))
+    if not os.path.exists(os.path.join(data_dir, "data.csv")):
+        print(f"Generating inputs in {data_dir}", flush=True)
+        generate(data_dir, args.rows, args.year, args.seed, jordan_rows)
+
+    suites = args.suites.split(",")
+    h = Harness(trace_memory=args.trace_memory)
+    results_dir = os.path.abspath(args.results_dir)
+    cwd = os.getcwd()
+    os.chdir(data_dir)  # the pipelines read their inputs from the working directory
+    try:
+        if "yoy" in suites:
+            print("yoy:")
+            run_yoy(h, args.year, args.rows, args.workers)
+        if "jordan" in suites:
+            print("jordan:")
+            run_jordan(h, jordan_rows)
+        if "snapchat" in suites:
+            print("snapchat:")
+            run_snapchat(h, args.squads, args.api_rate)
+    finally:
+        os.chdir(cwd)
+
+    meta = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "rows": args.rows,
+        "jordan_rows": jordan_rows,
+        "squads": args.squads,
+        "workers": args.workers,
+        "seed": args.seed,
+        "suites": suites,
+        "tracemalloc": args.trace_memory,
+    }
+    current = {"meta": meta, "stages": h.stages}
+    os.makedirs(results_dir, exist_ok=True)
+    earlier = sorted(glob.glob(os.path.join(results_dir, "*.json")))
+    path = os.path.join(results_dir, meta["timestamp"].replace(":", "") + ".json")
+    with open(path, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"\nSaved {path}")
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    else:
+        for candidate in reversed(earlier):
+            with open(candidate) as f:
+                result = json.load(f)
+            same_size = all(result["meta"].get(k) == meta[k] for k in ("rows", "jordan_rows", "squads", "seed", "tracemalloc"))
+            if same_size:
+                previous = result
+                break
+    if previous:
+        compare(current, previous, args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Modules shared by the reporting and bidding automations: the KPI registry
+(kpi_registry) and the opt-in stage tracer (instrument).
+"""
@@ -0,0 +1,185 @@
+import datetime
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+def count_rows(value) -> int | None:
+    """
+    Rows in a dataframe/series (or entries in a dict), or summed over a
+    tuple/list of them, e.g. the (daily, weekly) pairs the aggregations return;
+    None for anything else.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, dict)):
+        return len(value)
+    if isinstance(value, (tuple, list)) and value and all(isinstance(v, (pd.DataFrame, pd.Series, dict)) for v in value):
+        return sum(len(v) for v in value)
+    return None
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def rss_mb() -> float:
+    # Current resident set size; falls back to the peak where /proc isn't available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+class Stage:
+    """
+    One timed stage; set rows_out on it inside the `with` block if the
+    stage's output isn't a return value the tracer can see.
+    """
+    __slots__ = ("tracer", "name", "rows_in", "rows_out", "path", "_wall", "_cpu", "_traced", "_peak")
+
+    def __init__(self, tracer, name, rows_in=None):
+        self.tracer = tracer
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        if not self.tracer.enabled:
+            return self
+        self._peak = 0
+        self._traced = None
+        if self.tracer.trace_memory:
+            # the enclosing stage keeps its own high-water mark across the reset
+            if self.tracer._stack:
+                parent = self.tracer._stack[-1]
+                parent._peak = max(parent._peak, tracemalloc.get_traced_memory()[1] - parent._traced)
+            self._traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.path = f"{self.tracer._stack[-1].path}/{self.name}" if self.tracer._stack else self.name
+        self.tracer._stack.append(self)
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.tracer.enabled:
+            return False
+        wall, cpu = time.perf_counter() - self._wall, time.process_time() - self._cpu
+        self.tracer._stack.pop()
+        peak = None
+        if self._traced is not None:
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1] - self._traced)
+            peak = self._peak / 2**20
+            if self.tracer._stack:
+                parent = self.tracer._stack[-1]
+                parent._peak = max(parent._peak, self._peak + self._traced - parent._traced)
+        self.tracer.records.append({
+            "stage": self.name,
+            "path": self.path,
+            "depth": len(self.tracer._stack),
+            "start_s": round(self._wall - self.tracer._started_at, 6),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "peak_alloc_mb": None if peak is None else round(peak, 3),
+            "rss_mb": round(rss_mb(), 3),
+            "peak_rss_mb": round(peak_rss_mb(), 3),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "error": None if exc[0] is None else exc[0].__name__,
+        })
+        return False
+
+class Tracer:
+    """
+    Opt-in stage timer for the reporting scripts.
+
+    Wrap a stage in `with tracer.stage("name"):` or decorate a function with
+    @tracer.traced; both record wall time, CPU time, RSS (current and peak),
+    rows in/out and, with trace_memory, the stage's peak tracemalloc allocation.
+
+    Until enable() is called both are a flag check and nothing else.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.records = []
+        self._stack = []
+        self._started = None
+        self._started_at = 0.0
+
+    def enable(self, trace_memory=False):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self._started = datetime.datetime.now()
+        self._started_at = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name, rows_in=None) -> Stage:
+        return Stage(self, name, rows_in)
+
+    def traced(self, fn):
+        """
+        Decorator recording every call of fn as a stage named after it. Rows in
+        are counted from the first argument, rows out from the return value.
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            with Stage(self, fn.__name__, count_rows(args[0]) if args else None) as s:
+                result = fn(*args, **kwargs)
+                s.rows_out = count_rows(result)
+            return result
+        return wrapper
+
+    def summary(self) -> str:
+        """
+        Table of the recorded stages, one line per stage in the call tree
+        (calls, total wall and CPU seconds, largest peak allocation/RSS, total
+        rows in and out), nested stages indented under the stage they ran in.
+        """
+        if not self.records:
+            return "No stages recorded."
+        df = pd.DataFrame(self.records)
+
+        def total(values):
+            return values.sum(min_count=1)
+
+        table = df.groupby("path", sort=False).agg(
+            stage=("stage", "first"),
+            depth=("depth", "first"),
+            start_s=("start_s", "min"),
+            calls=("stage", "size"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            peak_alloc_mb=("peak_alloc_mb", "max"),
+            peak_rss_mb=("peak_rss_mb", "max"),
+            rows_in=("rows_in", total),
+            rows_out=("rows_out", total),
+        ).sort_values("start_s")
+        table.index = ["  " * depth + stage for stage, depth in zip(table["stage"], table["depth"])]
+        table = table.drop(columns=["stage", "depth", "start_s"])
+        if not self.trace_memory:
+            table = table.drop(columns=["peak_alloc_mb"])
+        for col in ["rows_in", "rows_out"]:
+            table[col] = [("" if pd.isna(rows) else int(rows)) for rows in table[col]]
+        return table.round(3).to_string()
+
+    def write(self, path: str) -> None:
+        """
+        Writes the records as a JSON trace: {"meta": {...}, "stages": [...]}.
+        """
+        meta = {
+            "started": None if self._started is None else self._started.isoformat(timespec="seconds"),
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "tracemalloc": self.trace_memory,
+        }
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "stages": self.records}, f, indent=2)
+
+tracer = Tracer()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+class KPI(NamedTuple):
+    """
+    A ratio metric: sum of the numerator columns over sum of the denominator
+    columns, times scale.
+
+    NB: numerator and denominator are a column name or a tuple of column names
+    that get added together, e.g. ('visits', 'opens').
+    """
+    numerator: str | tuple[str, ...]
+    denominator: str | tuple[str, ...]
+    scale: float = 1
+
+# KPIs over the standard summed columns (demand, spend, orders, visits, impressions, clicks)
+KPIS = {
+    'ROAS': KPI('demand', 'spend'),
+    'CPV': KPI('spend', 'visits'),
+    'CVR': KPI('orders', 'visits'),
+    'AOV': KPI('demand', 'orders'),
+    'CPM': KPI('spend', 'impressions', 1000),
+    'CPC': KPI('spend', 'clicks'),
+    'CTR': KPI('clicks', 'impressions', 100),
+    'CPA': KPI('spend', 'orders'),
+}
+
+def _column_sum(df: pd.DataFrame, cols: str | tuple[str, ...]) -> np.ndarray:
+    if isinstance(cols, str):
+        return df[cols].to_numpy(dtype=float)
+    return np.sum([df[col].to_numpy(dtype=float) for col in cols], axis=0)
+
+def evaluate_kpis(df: pd.DataFrame, names: list[str], registry: dict[str, KPI] = KPIS) -> pd.DataFrame:
+    """
+    Adds a column for each of the named KPIs in the registry, all divided in
+    one array operation.
+
+    INPUTS:
+        df: aggregated data with the columns the KPIs are defined over
+        names: KPIs to add (names not in the registry, e.g. 'spend', are skipped)
+        registry: KPI definitions, by name
+
+    OUTPUT: df with the KPI columns added (in place).
+
+    NB: a zero denominator gives NaN rather than inf. Only run this on
+    aggregated data, as ratios of sums are not sums of ratios.
+    """
+    names = [name for name in names if name in registry]
+    if not names:
+        return df
+    sums = {}
+    for name in names:
+        for cols in registry[name][:2]:
+            if cols not in sums:
+                sums[cols] = _column_sum(df, cols)
+    numerators = np.column_stack([sums[registry[name].numerator] for name in names])
+    denominators = np.column_stack([sums[registry[name].denominator] for name in names])
+    scales = np.array([registry[name].scale for name in names], dtype=float)
+
+    values = np.full(numerators.shape, np.nan)
+    np.divide(numerators, denominators, out=values, where=denominators != 0)
+    df[names] = values * scales
+    return df
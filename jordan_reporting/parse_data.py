@@ -1,89 +1,246 @@
 import pandas as pd
+import numpy as np
+import argparse
+import os
+import sys
+import warnings
+
+# the KPI registry and stage tracer are shared with the other automations, in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.instrument import tracer
+from common.kpi_registry import KPI, evaluate_kpis
+
+FILL_COLS = ['retail_week', 'fop', 'cp_general_creative_name']
+SUM_COLS = ['Media Spend', 'Demand', 'Clicks', 'Impressions', 'Visits (Adobe)', 'Opens (App)']
+SUMMARY_FOPS = ['sport', 'streetwear']
+REPORT_KPIS = {
+    'ROAS': KPI('Demand', 'Media Spend'),
+    'CTR': KPI('Clicks', 'Impressions', 100),
+    'CPV': KPI('Media Spend', ('Visits (Adobe)', 'Opens (App)')),  # per web visit or app open
+    'CPM': KPI('Media Spend', 'Impressions', 1000),
+}
+
+# characters stripped from each kind of formatted cell before it's read as a number
+FORMATS = {
+    'currency': r'[$,]',  # e.g. $1,234.56
+    'percent': r'%',      # e.g. 1.23% -> 1.23
+    'integer': r',',      # e.g. 12,345
+}
+COLUMN_FORMATS = {
+    'Media Spend': 'currency',
+    'ROAS': 'currency',
+    'CPV': 'currency',
+    'CTR': 'percent',
+    'Demand': 'currency',
+    'Impressions': 'integer',
+    'Clicks': 'integer',
+    'Visits (Adobe)': 'integer',
+    'Opens (App)': 'integer',
+}
+
+@tracer.traced
+def parse_columns(df: pd.DataFrame, column_formats: dict[str, str] = COLUMN_FORMATS, errors: str = 'raise') -> pd.DataFrame:
+    """
+    Converts formatted string columns to floats, one vectorized pass per format
+    rather than one regex/astype per column.
 
-file_path = "data.csv"
-df = pd.read_csv(file_path)
-
-df['retail_week'] = df['retail_week'].ffill()
-df['fop'] = df['fop'].ffill()
-df['cp_general_creative_name'] = df['cp_general_creative_name'].ffill()
-
-df = df[~df['retail_week'].astype(str).str.contains('Total', na=False)]
-df = df[~df['fop'].astype(str).str.contains('Total', na=False)]
-df = df[df['cp_general_creative_name'] != "dynamic"]
-
-df['retail_week'] = df['retail_week'].astype(int)
-current_week = df['retail_week'].max() # this will not work when current_week = 1
-previous_week = df['retail_week'].min()
-
-df['Media Spend'] = df['Media Spend'].replace('[\$,]', '', regex=True).astype(float)
-df['ROAS'] = df['ROAS'].replace('[\$,]', '', regex=True).astype(float)
-df['CPV'] = df['CPV'].replace('[\$,]', '', regex=True).astype(float)
-df['CTR'] = df['CTR'].str.replace('%', '').astype(float)
-df['Demand'] = df['Demand'].replace('[\$,]', '', regex=True).astype(float)
-df['Impressions'] = df['Impressions'].replace(',', '', regex=True).astype(float)
-df['Clicks'] = df['Clicks'].replace(',', '', regex=True).astype(float)
-df['Visits (Adobe)'] = df['Visits (Adobe)'].replace(',', '', regex=True).astype(float)
-df['Opens (App)'] = df['Opens (App)'].replace(',', '', regex=True).astype(float)
-
-curr_df = df[df['retail_week'] == current_week]
-prev_df = df[df['retail_week'] == previous_week]
-
-current_demand = curr_df['Demand'].sum()
-current_spend = curr_df['Media Spend'].sum()
-current_ROAS = (current_demand/current_spend).round(2)
-previous_demand = prev_df['Demand'].sum()
-previous_spend = prev_df['Media Spend'].sum()
-previous_ROAS = (previous_demand/previous_spend).round(2)
-WoW_ROAS = ((current_ROAS - previous_ROAS)/previous_ROAS*100).astype(int)
-
-current_clicks = curr_df['Clicks'].sum()
-current_imps = curr_df['Impressions'].sum()
-current_CTR = (current_clicks/current_imps*100).round(2)
-previous_clicks = prev_df['Clicks'].sum()
-previous_imps = prev_df['Impressions'].sum()
-previous_CTR = (previous_clicks/previous_imps*100).round(2)
-WoW_CTR = ((current_CTR - previous_CTR)/previous_CTR*100).astype(int)
-
-current_spend = curr_df['Media Spend'].sum().astype(int)
-previous_spend = prev_df['Media Spend'].sum().astype(int)
-WoW_spend = ((current_spend - previous_spend)/previous_spend*100).astype(int)
-
-current_CPV = (current_spend/(curr_df['Visits (Adobe)'].sum() + curr_df['Opens (App)'].sum())).round(2)
-previous_CPV = (previous_spend/(prev_df['Visits (Adobe)'].sum() + prev_df['Opens (App)'].sum())).round(2)
-WoW_CPV = ((current_CPV - previous_CPV)/previous_CPV).round(2)
-
-current_CPM = (current_spend/curr_df['Impressions'].sum()*1000).round(2)
-previous_CPM = (previous_spend/prev_df['Impressions'].sum()*1000).round(2)
-WoW_CPM = ((current_CPM - previous_CPM)/previous_CPM).round(2)
-
-sport_demand = curr_df.loc[curr_df['fop'] == "sport", 'Demand'].sum().astype(int)
-sport_visits = curr_df.loc[curr_df['fop'] == "sport", 'Visits (Adobe)'].sum().astype(int)
-top_sport_creative = curr_df.loc[curr_df[(curr_df['fop'] == "sport") & (curr_df['Demand'] != 0)]['CTR'].idxmax(), 'cp_general_creative_name']
-sport_creative_CTR = curr_df.loc[curr_df['cp_general_creative_name'] == top_sport_creative, 'CTR'].iloc[0].round(2)
-
-streetwear_demand = curr_df.loc[curr_df['fop'] == "streetwear", 'Demand'].sum().astype(int)
-streetwear_visits = curr_df.loc[curr_df['fop'] == "streetwear", 'Visits (Adobe)'].sum().astype(int)
-top_streetwear_creative = curr_df.loc[curr_df[(curr_df['fop'] == "streetwear") & (curr_df['Demand'] != 0)]['CTR'].idxmax(), 'cp_general_creative_name']
-streetwear_creative_CTR = curr_df.loc[curr_df['cp_general_creative_name'] == top_streetwear_creative, 'CTR'].iloc[0].round(2)
-
-if current_week != 1:
-    output = f"""
-    Week {current_week} Jordan Performance Metrics (Excluding Dynamic)
-
-    WK {current_week} Spend = ${current_spend}; WK {previous_week} Spend = ${previous_spend}; Spend Change WoW = {WoW_spend}%
-    WK {current_week} ROAS = ${current_ROAS}; WK {previous_week} ROAS = ${previous_ROAS}; ROAS Change WoW = {WoW_ROAS}%
-    WK {current_week} CTR = {current_CTR}%; WK {previous_week} CTR = {previous_CTR}%; CTR Change WoW = {WoW_CTR}%
-    WK {current_week} CPV = ${current_CPV}; WK {previous_week} CPV = ${previous_CPV}; CPV Change WoW = {WoW_CPV}%
-    WK {current_week} CPM = ${current_CPM}; WK {previous_week} CPM = ${previous_CPM}; CPM Change WoW = {WoW_CPM}%
+    Cells that still aren't numbers once their format's characters are stripped
+    are reported by row and column. With errors='raise' that's a ValueError;
+    with errors='coerce' it's a warning and the cells become NaN.
+    """
+    df = df.copy()
+    malformed = []
+    for fmt, pattern in FORMATS.items():
+        cols = [col for col, col_fmt in column_formats.items() if col_fmt == fmt and col in df]
+        if not cols:
+            continue
+        raw = pd.Series(df[cols].to_numpy(dtype=object).ravel(), dtype="string")
+        stripped = raw.str.replace(pattern, '', regex=True).str.strip()
+        parsed = pd.to_numeric(stripped, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        bad = np.flatnonzero(np.isnan(parsed) & stripped.fillna('').ne('').to_numpy())
+        malformed += [f"row {df.index[i // len(cols)]}, column '{cols[i % len(cols)]}' ({fmt}): {raw.iloc[i]!r}" for i in bad]
+        df[cols] = parsed.reshape(len(df), len(cols))
+    if malformed:
+        message = "Malformed values:\n  " + "\n  ".join(malformed)
+        if errors == 'raise':
+            raise ValueError(message)
+        warnings.warn(message)
+    return df
+
+@tracer.traced
+def read_report(file_path: str, n_weeks: int | None = 2, chunksize: int = 100_000,
+                errors: str = 'coerce') -> pd.DataFrame:
+    """
+    Streams the creative export in chunks, keeping only the creative-level rows
+    of the latest n_weeks retail weeks (or every week if n_weeks is None).
+
+    The export only labels the first row of each week/fop/creative group, so those
+    columns are forward-filled, carrying the last label over chunk boundaries.
+    Subtotal ("Total") rows and dynamic creative are dropped as each chunk is read,
+    as are weeks that fall out of the latest n_weeks seen so far, so memory use
+    depends on the weeks kept rather than the size of the file. The metric
+    columns of the rows that are kept are converted with parse_columns; by
+    default malformed cells are reported in a warning and read as NaN
+    (errors='raise' makes them an error instead).
+
+    NB: weeks are ordered as they appear in the file, oldest first. Each week
+    block is numbered in a season_week column, so the same week number from two
+    different years (e.g. week 1 at both ends of a full-year export) stays two
+    separate weeks.
+    """
+    carry = {col: None for col in FILL_COLS}
+    last_label, season_week = None, 0
+    weeks = {}
+    dtypes = {col: str for col in FILL_COLS + list(COLUMN_FORMATS)}
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, dtype=dtypes):
+        # a new week block starts wherever the week label changes
+        labels = chunk['retail_week']
+        labels = labels[labels.notna() & ~labels.str.contains('Total', na=False)]
+        starts = labels.ne(labels.shift(1, fill_value=last_label))
+        block = starts.astype(int).cumsum().reindex(chunk.index).ffill().fillna(0).astype(int)
+        chunk['season_week'] = season_week + block
+        season_week += int(starts.sum())
+        if len(labels):
+            last_label = labels.iloc[-1]
+
+        for col in FILL_COLS:
+            chunk[col] = chunk[col].ffill()
+            if carry[col] is not None:
+                chunk[col] = chunk[col].fillna(carry[col])
+            if chunk[col].notna().any():
+                carry[col] = chunk[col].dropna().iloc[-1]
+
+        chunk = chunk[~chunk['retail_week'].str.contains('Total', na=False)]
+        chunk = chunk[~chunk['fop'].str.contains('Total', na=False)]
+        chunk = chunk[chunk['cp_general_creative_name'] != "dynamic"]
+        chunk = chunk.assign(retail_week=chunk['retail_week'].astype(int))
+        chunk = parse_columns(chunk, errors=errors)
+
+        for week, week_df in chunk.groupby('season_week'):
+            weeks.setdefault(week, []).append(week_df)
+        if n_weeks is not None:
+            for week in sorted(weeks)[:-n_weeks]:
+                del weeks[week]
+
+    return pd.concat([part for week in sorted(weeks) for part in weeks[week]])
+
+@tracer.traced
+def add_report_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds ROAS, CTR (in %), CPV (per web visit or app open) and CPM to summed data.
+    """
+    return evaluate_kpis(df, list(REPORT_KPIS), REPORT_KPIS)
 
-    WK {current_week} Sport generated ${sport_demand} in Demand and {sport_visits} Visits
-    The top performing Sport creative by CTR in WK {current_week} was {top_sport_creative} ({sport_creative_CTR}% CTR)
+@tracer.traced
+def build_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds every week's KPIs for each fop, and for all fops together (fop 'Total'),
+    from one groupby over (season_week, fop).
 
-    WK {current_week} Streetwear generated ${streetwear_demand} in Demand and {streetwear_visits} Visits
-    The top performing Streetwear creative by CTR in WK {current_week} was {top_streetwear_creative} ({streetwear_creative_CTR}% CTR)
+    OUTPUT: dataframe indexed by (season_week, fop) in season order, with
+    retail_week, summed columns, KPIs, previous_week and a '{col} WoW' % change
+    for every column, plus the top creative by CTR (among rows with demand) in
+    top_creative and top_creative_CTR.
+    """
+    by_fop = df.groupby(['season_week', 'retail_week', 'fop'])[SUM_COLS].sum()
+    totals = by_fop.groupby(level=['season_week', 'retail_week']).sum()
+    totals['fop'] = 'Total'
+    totals = totals.set_index('fop', append=True)
+    report = add_report_kpis(pd.concat([by_fop, totals]))
+    report = report.reset_index().sort_values(['season_week', 'fop'])
+
+    value_cols = SUM_COLS + list(REPORT_KPIS)
+    previous = report.groupby('fop')[['retail_week'] + value_cols].shift(1)
+    report['previous_week'] = previous['retail_week'].astype('Int64')
+    wow = (report[value_cols] - previous[value_cols])/previous[value_cols]*100
+    report[[f'{col} WoW' for col in value_cols]] = wow.to_numpy()
+
+    # rows with a blank/malformed CTR can't be ranked; a group with none left gets no top creative
+    with_demand = df[df['Demand'] != 0].dropna(subset=['CTR'])
+    top_rows = with_demand.groupby(['season_week', 'fop'])['CTR'].idxmax()
+    top = df.loc[top_rows, ['season_week', 'fop', 'cp_general_creative_name', 'CTR']]
+    top = top.rename(columns={'cp_general_creative_name': 'top_creative', 'CTR': 'top_creative_CTR'})
+    report = report.merge(top, on=['season_week', 'fop'], how='left')
+    return report.set_index(['season_week', 'fop'])
+
+@tracer.traced
+def format_summary(report: pd.DataFrame, week: int, fops: list[str] = SUMMARY_FOPS) -> str:
+    """
+    Writes the summary for one week (a season_week) of a report from build_report.
     """
-else: 
-    output = "Oops, this automation does not work in Week 1!"
+    totals = report.xs('Total', level='fop')
+    position = totals.index.get_loc(week)
+    if position == 0:
+        return f"Oops, there is no week before WK {totals.loc[week, 'retail_week']} in this data!"
+    total, prev = totals.iloc[position], totals.iloc[position - 1]
+    week_number, prev_week = total['retail_week'], prev['retail_week']
+
+    def wow(col):
+        # a previous week of 0 (or missing) makes the change inf/NaN
+        change = total[f'{col} WoW']
+        return f"{int(change)}%" if np.isfinite(change) else "n/a"
 
-with open("summary.txt", "a") as f:
-    f.write(output + "\n")
+    output = f"""
+    Week {week_number} Jordan Performance Metrics (Excluding Dynamic)
+
+    WK {week_number} Spend = ${int(total['Media Spend'])}; WK {prev_week} Spend = ${int(prev['Media Spend'])}; Spend Change WoW = {wow('Media Spend')}
+    WK {week_number} ROAS = ${round(total['ROAS'], 2)}; WK {prev_week} ROAS = ${round(prev['ROAS'], 2)}; ROAS Change WoW = {wow('ROAS')}
+    WK {week_number} CTR = {round(total['CTR'], 2)}%; WK {prev_week} CTR = {round(prev['CTR'], 2)}%; CTR Change WoW = {wow('CTR')}
+    WK {week_number} CPV = ${round(total['CPV'], 2)}; WK {prev_week} CPV = ${round(prev['CPV'], 2)}; CPV Change WoW = {wow('CPV')}
+    WK {week_number} CPM = ${round(total['CPM'], 2)}; WK {prev_week} CPM = ${round(prev['CPM'], 2)}; CPM Change WoW = {wow('CPM')}
+"""
+    for fop in fops:
+        if (week, fop) not in report.index:
+            continue
+        row = report.loc[(week, fop)]
+        if pd.isna(row['top_creative']):
+            top_creative = "n/a"
+        else:
+            top_creative = f"{row['top_creative']} ({round(row['top_creative_CTR'], 2)}% CTR)"
+        output += f"""
+    WK {week_number} {fop.title()} generated ${int(row['Demand'])} in Demand and {int(row['Visits (Adobe)'])} Visits
+    The top performing {fop.title()} creative by CTR in WK {week_number} was {top_creative}
+"""
+    return output + "    "
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Weekly Jordan performance summary from the creative export.")
+    parser.add_argument("file_path", nargs="?", default="data.csv")
+    parser.add_argument("--all-weeks", action="store_true",
+                        help="write a summary for every week in the file, not just the latest")
+    parser.add_argument("--strict", action="store_true",
+                        help="stop on malformed cells instead of warning and treating them as missing")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="time each stage, write the trace to PATH as JSON and print a summary")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --trace, also record each stage's peak allocations (slower)")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracer.enable(trace_memory=args.trace_memory)
+    try:
+        run(args)
+    finally:
+        if args.trace:
+            tracer.write(args.trace)
+            print(tracer.summary(), file=sys.stderr)
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Writes the summaries for parsed command line arguments (see main).
+    """
+    df = read_report(args.file_path, n_weeks=None if args.all_weeks else 2,
+                     errors='raise' if args.strict else 'coerce')
+    report = build_report(df)
+    weeks = sorted(df['season_week'].unique())
+    if args.all_weeks:
+        weeks = weeks[1:]
+    else:
+        weeks = weeks[-1:]
+
+    with tracer.stage("write summary"), open("summary.txt", "a") as f:
+        for week in weeks:
+            f.write(format_summary(report, week) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import hashlib
+import glob
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # caching is skipped without pyarrow
+    feather = None
+
+CACHE_DIR = ".yoy_cache"
+
+def _path_hash(path: str, *parts) -> str:
+    """
+    Short hex digest of a file's absolute path plus any extra key parts.
+    """
+    raw = "|".join([os.path.abspath(path), *map(str, parts)])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def cache_path(path: str, version: str, cache_dir: str = CACHE_DIR) -> str:
+    """
+    Gets where the cached copy of a source file lives.
+
+    The name changes whenever the source's mtime or size, or the version, does,
+    so a stale entry is never read.
+    """
+    st = os.stat(path)
+    key = _path_hash(path, st.st_mtime_ns, st.st_size, version)
+    return os.path.join(cache_dir, f"{_path_hash(path)}-{key}.feather")
+
+def cached_frame(path: str, build, version: str, cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    """
+    Loads the dataframe built from a source file, using an uncompressed Feather
+    copy on disk when the source hasn't changed since it was cached.
+
+    INPUTS:
+        path: the source file (e.g. '2024.csv')
+        build: function taking path and returning the prepared dataframe
+        version: schema version of what build returns; bump it when build changes
+        cache_dir: directory the Feather files are kept in
+
+    OUTPUT: the prepared dataframe
+
+    NB: cached files are memory-mapped on read, and numeric columns without
+    nulls are used in place rather than copied. Older entries for the same
+    source are deleted when a new one is written. Without pyarrow this just
+    calls build.
+    """
+    if feather is None:
+        return build(path)
+    target = cache_path(path, version, cache_dir)
+    if os.path.exists(target):
+        return feather.read_table(target, memory_map=True).to_pandas(split_blocks=True)
+
+    df = build(path)
+    _write(path, df, target, cache_dir)
+    return df
+
+def ensure_cached(path: str, build, version: str, cache_dir: str = CACHE_DIR) -> str | None:
+    """
+    Same as cached_frame, but only makes sure the cached copy exists and
+    returns where it is, without loading it.
+
+    Meant for worker processes: the frame then reaches the parent as a
+    memory-mapped Arrow file rather than being pickled back. Returns None
+    without pyarrow.
+    """
+    if feather is None:
+        return None
+    target = cache_path(path, version, cache_dir)
+    if not os.path.exists(target):
+        _write(path, build(path), target, cache_dir)
+    return target
+
+def _write(path: str, df: pd.DataFrame, target: str, cache_dir: str) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(cache_dir, f"{_path_hash(path)}-*.feather")):
+        if stale != target:
+            os.remove(stale)
+    # unique tmp name, so two processes caching the same source don't collide
+    tmp = f"{target}.{os.getpid()}.tmp"
+    feather.write_feather(df.reset_index(drop=True), tmp, compression="uncompressed")
+    os.replace(tmp, target)
@@ -1,7 +1,22 @@
 import pandas as pd
+import numpy as np
 import sys
+import os
+import json
 import math
+import argparse
 import datetime
+import functools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import frame_cache
+from frame_cache import cached_frame, ensure_cached
+
+# the KPI registry and stage tracer are shared with the other automations, in common/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.instrument import tracer
+from common.kpi_registry import evaluate_kpis
 
 ### INPUTS
 kpis = ['ROAS', 'spend', 'CPV', 'CVR', 'AOV', 'CPM', 'CPC']
@@ -10,6 +25,45 @@ yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
 thisyear = yesterday.year
 lastyear = thisyear - 1
 
+class Slice(NamedTuple):
+    """
+    A reporting slice: which channel's data it reads from, and optionally which
+    platform and campaign keyword it is filtered down to.
+
+    NB: channel is 'social' or 'web'; platform and campaign of None mean no filter.
+    campaign is a keyword that appears in campaign_name - make sure it's unique
+    to that campaign, e.g. "mens_18+" rather than just "mens" for Mens 18+.
+    """
+    name: str
+    channel: str
+    platform: str | None = None
+    campaign: str | None = None
+
+slices = [
+    Slice('ALLUP', 'social'),
+    Slice('ALLUP - WEB ONLY', 'web'),
+    Slice('META DYNAMIC', 'social', 'meta', 'dynamic'),
+    Slice('META PROMO', 'social', 'meta', 'promo'),
+]
+STORE_PATH = "daily_aggregates"
+# how each column of the social/web exports is stored once loaded: identifiers as
+# categoricals, metrics as the narrowest integer/float dtype that holds every value
+SCHEMA = {
+    'platform': 'category',
+    'campaign_name': 'category',
+    'media_spend': 'float',
+    'impressions': 'integer',
+    'clicks': 'integer',
+    'lc_demand_digital_web_app_adobe': 'float',
+    'lc_orders_digital_web_app_adobe': 'integer',
+    'lc_visits_digital_web_app_adobe': 'integer',
+    'adobe_revenue': 'float',
+    'adobe_orders': 'integer',
+    'adobe_visits': 'integer',
+}
+PROMOS_PATH = "promos.csv"
+
+@functools.lru_cache(maxsize=None)
 def black_friday(year: int) -> datetime.date:
     """
     Gets the date, as a datetime date, of Black Friday for the given year.
@@ -21,12 +75,37 @@ def black_friday(year: int) -> datetime.date:
     bf = tgiving + datetime.timedelta(days=1)
     return bf
 
-def load_df(df_name: str) -> pd.DataFrame:
+@tracer.traced
+def load_df(df_name: str, schema: dict[str, str] = SCHEMA) -> pd.DataFrame:
     """
-    Loads data (csv) into a dataframe.
+    Loads data (csv) into a dataframe, with the compact dtypes in the schema.
+
+    NB: columns not in the schema get read_csv's default dtypes.
     """
     filename = df_name + '.csv'
-    df = pd.read_csv(filename)
+    categories = {col: 'category' for col, kind in schema.items() if kind == 'category'}
+    df = pd.read_csv(filename, dtype=categories)
+    return downcast(df, schema)
+
+def downcast(df: pd.DataFrame, schema: dict[str, str] = SCHEMA) -> pd.DataFrame:
+    """
+    Narrows the schema's 'integer' columns to the smallest integer dtype that fits
+    their values, and its 'float' columns to float32 where that loses nothing.
+
+    NB: integer columns with blanks, and float columns with values float32 can't
+    hold exactly (e.g. most cents), are left as they are. Groupby sums upcast
+    narrow integers to int64, so aggregates can't overflow.
+    """
+    for col, kind in schema.items():
+        if col not in df:
+            continue
+        if kind == 'integer':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif kind == 'float':
+            values = df[col].to_numpy(dtype=np.float64)
+            narrow = values.astype(np.float32)
+            if np.array_equal(narrow, values, equal_nan=True):
+                df[col] = narrow
     return df
 
 def get_bf_week(bf_date: int) -> int:
@@ -40,10 +119,33 @@ def get_bf_week(bf_date: int) -> int:
     """
     return math.ceil((bf_date - 1) / 7)
 
-def prepare_df(df: pd.DataFrame, year: int) -> pd.DataFrame:
+def add_bf_calendar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds year, bf_date and bf_week columns to a dataframe with a 'date' column.
+
+    Each row is anchored to Black Friday of its own date's year, so files that
+    span a year boundary get the right offsets. Everything is integer array math;
+    black_friday is only called once per distinct year.
+    """
+    dates = df["date"].to_numpy(dtype="datetime64[D]")
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    first_year = years.min() if len(years) else 0
+    anchors = np.array(
+        [black_friday(int(y)) for y in range(first_year, years.max() + 1)] if len(years) else [],
+        dtype="datetime64[D]",
+    )
+    bf_date = (dates - anchors[years - first_year]).astype(np.int64)
+    df["year"] = years.astype(np.int16)
+    df["bf_date"] = bf_date.astype(np.int16)
+    # same as get_bf_week: ceil((bf_date - 1) / 7), in integer floor division
+    df["bf_week"] = (-((1 - bf_date) // 7)).astype(np.int8)
+    return df
+
+@tracer.traced
+def prepare_df(df: pd.DataFrame) -> pd.DataFrame:
     """
     Shortens the names of relevant columns, converts dates to datetimes, and
-    adds Black Friday date to each row based on the given year.
+    adds Black Friday date to each row based on the year of its date.
     
     A Black Friday date is an integer representing the number of days from that
     calendar date to Black Friday of that year.
@@ -51,9 +153,7 @@ def prepare_df(df: pd.DataFrame, year: int) -> pd.DataFrame:
     NB: BF dates imply directionality in their signage.
     """
     df["date"] = pd.to_datetime(df["date_day"], format="%m/%d/%Y")
-    bf = black_friday(year)
-    df["bf_date"] = (df["date"] - pd.to_datetime(bf)).dt.days
-    df["bf_week"] = df["bf_date"].apply(get_bf_week)
+    df = add_bf_calendar(df)
     df = df.rename(columns={
         "lc_demand_digital_web_app_adobe": "demand",
         "lc_orders_digital_web_app_adobe": "orders",
@@ -63,17 +163,16 @@ def prepare_df(df: pd.DataFrame, year: int) -> pd.DataFrame:
     df = df.drop(columns=['date_day'])
     return df
 
-def prepare_web_df(df: pd.DataFrame, year: int) -> pd.DataFrame:
+@tracer.traced
+def prepare_web_df(df: pd.DataFrame) -> pd.DataFrame:
     """
     Shortens the names of relevant columns, converts dates to datetimes, and
-    adds Black Friday date to each row based on the given year.
+    adds Black Friday date to each row based on the year of its date.
     
     SPECIFICALLY FOR WEB DATA
     """
     df["date"] = pd.to_datetime(df["date_day"], format="%m/%d/%Y")
-    bf = black_friday(year)
-    df["bf_date"] = (df["date"] - pd.to_datetime(bf)).dt.days
-    df["bf_week"] = df["bf_date"].apply(get_bf_week)
+    df = add_bf_calendar(df)
     df = df.rename(columns={
         "adobe_revenue": "demand",
         "adobe_orders": "orders",
@@ -83,6 +182,34 @@ def prepare_web_df(df: pd.DataFrame, year: int) -> pd.DataFrame:
     df = df.drop(columns=['date_day'])
     return df
 
+# bump when prepare_df/prepare_web_df change what they return
+PREPARED_SCHEMA_VERSION = 2
+
+@tracer.traced
+def load_prepared(df_name: str, prepare) -> pd.DataFrame:
+    """
+    Loads data (csv) and prepares it with the given prepare function, reusing the
+    on-disk columnar cache when the csv hasn't changed since the last run.
+    """
+    df = cached_frame(
+        df_name + '.csv',
+        lambda path: prepare(load_df(df_name)),
+        f'{prepare.__name__}-v{PREPARED_SCHEMA_VERSION}',
+    )
+    # promos are added after the cache, so editing promos.csv doesn't invalidate it
+    return add_promos(df)
+
+def cache_prepared(df_name: str, prepare) -> None:
+    """
+    Makes sure the prepared copy of a source is in the on-disk cache, so a later
+    load_prepared just memory-maps it. Runs in load_sources' worker processes.
+    """
+    ensure_cached(
+        df_name + '.csv',
+        lambda path: prepare(load_df(df_name)),
+        f'{prepare.__name__}-v{PREPARED_SCHEMA_VERSION}',
+    )
+
 def get_date_from_bf_date(year: int, bf_date: int) -> datetime.date:
     """
     Gets a datetime date from the BF date in a given year.
@@ -90,46 +217,38 @@ def get_date_from_bf_date(year: int, bf_date: int) -> datetime.date:
     bf = black_friday(year)
     return bf + datetime.timedelta(days=bf_date)
 
-def filter_platform(df: pd.DataFrame, platform: str) -> pd.DataFrame:
-    """
-    Filters a dataframe down to only contain data from the given platform.
+def contains_keyword(values: pd.Series, keyword: str) -> np.ndarray:
     """
-    platform_df = df[df["platform"] == platform]
-    return platform_df
+    Case-insensitive str.contains as a boolean array (missing values are False).
 
-def filter_campaign(df: pd.DataFrame, keyword: str) -> pd.DataFrame:
+    NB: for a categorical, only the distinct values (categories) are searched and
+    the result is broadcast to the rows through the codes, so the cost follows
+    the number of distinct campaigns rather than the number of rows.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        matches = np.asarray(values.cat.categories.str.contains(keyword, case=False), dtype=bool)
+        codes = values.cat.codes.to_numpy()
+        return np.append(matches, False)[codes]  # code -1 (missing) picks the False
+    return values.str.contains(keyword, case=False, na=False).to_numpy(dtype=bool)
+
+@tracer.traced
+def add_kpis(df: pd.DataFrame, kpis: list[str]) -> pd.DataFrame:
     """
-    Filters a dataframe down to only contain data from the given campaign.
+    Adds a column for each of the given KPIs, calculated from summed columns
+    with the definitions in common.kpi_registry.KPIS.
 
-    NB: campaign should be entered as a keyword that appears in campaign_name -
-    make sure the keyword is unique to only that campaign!
-    
-    e.g. for Mens 18+ campaigns, I would use "mens_18+" rather than just "mens"
+    NB: only run this on aggregated data, as ratios of sums are not sums of ratios.
     """
-    campaign_df = df[df["campaign_name"].str.contains(keyword, case=False, na=False)]
-    return campaign_df
+    return evaluate_kpis(df, kpis)
 
 def aggregate_by_day(df: pd.DataFrame, kpis: list[str]) -> pd.DataFrame:
     """
     Aggregates a dataframe so that there is only one row per date. 
 
-    Sums every column except date and bf_date, which it groups by. 
+    Sums every numeric column except date and bf_date, which it groups by. 
     """
-    df = df.groupby(["date", "bf_date"], as_index=False).sum()
-    for kpi in kpis:
-        if kpi == 'ROAS':
-            df[kpi] = df['demand']/df['spend']
-        elif kpi == 'CPV':
-            df[kpi] = df['spend']/df['visits']
-        elif kpi == 'CVR':
-            df[kpi] = df['orders']/df['visits']
-        elif kpi == 'AOV':
-            df[kpi] = df['demand']/df['orders']
-        elif kpi == 'CPM':
-            df[kpi] = df['spend']/df['impressions']*1000
-        elif kpi == 'CPC':
-            df[kpi] = df['spend']/df['clicks']
-    return df
+    df = df.groupby(["date", "bf_date"], as_index=False).sum(numeric_only=True)
+    return add_kpis(df, kpis)
 
 def aggregate_by_week(df: pd.DataFrame, kpis: list[str]) -> pd.DataFrame:
     """
@@ -138,44 +257,245 @@ def aggregate_by_week(df: pd.DataFrame, kpis: list[str]) -> pd.DataFrame:
     NB: logic requires this be run on a df that has NOT been aggregated by day.
     """
     df = df.drop(columns=['date', 'bf_date'])
-    df = df.groupby(["bf_week"], as_index=False).sum()
-    for kpi in kpis:
-        if kpi == 'ROAS':
-            df[kpi] = df['demand']/df['spend']
-        elif kpi == 'CPV':
-            df[kpi] = df['spend']/df['visits']
-        elif kpi == 'CVR':
-            df[kpi] = df['orders']/df['visits']
-        elif kpi == 'AOV':
-            df[kpi] = df['demand']/df['orders']
-        elif kpi == 'CPM':
-            df[kpi] = df['spend']/df['impressions']*1000
-        elif kpi == 'CPC':
-            df[kpi] = df['spend']/df['clicks']
-    return df
+    df = df.groupby(["bf_week"], as_index=False).sum(numeric_only=True)
+    return add_kpis(df, kpis)
 
-def percent_change(current: float, former: float) -> int:
+def tag_slices(df: pd.DataFrame, slices: list[Slice]) -> pd.DataFrame:
     """
-    Calculates percent change between a current and former value.
+    Repeats each row of a dataframe once for every slice it belongs to, with the
+    slice's name in a categorical 'slice' column.
+
+    Requires a 'channel' column. Each campaign keyword is only matched once, no
+    matter how many slices share it.
     """
-    if former == 0 or math.isinf(former) or math.isnan(former):
-        return "no data for last year"
-    elif current == 0 or math.isinf(former) or math.isnan(current):
-        return "no data for this year"
-    else:
-        return (((current - former)/former)*100).astype(int)
+    campaign_matches = {}
+    masks = []
+    for s in slices:
+        mask = (df["channel"] == s.channel).to_numpy(dtype=bool, copy=True)
+        if s.platform is not None:
+            mask &= (df["platform"] == s.platform).to_numpy()
+        if s.campaign is not None:
+            if s.campaign not in campaign_matches:
+                campaign_matches[s.campaign] = contains_keyword(df["campaign_name"], s.campaign)
+            mask &= campaign_matches[s.campaign]
+        masks.append(mask)
+    rows = [np.flatnonzero(mask) for mask in masks]
+    codes = np.repeat(np.arange(len(slices)), [len(r) for r in rows])
+    tagged = df.iloc[np.concatenate(rows)].reset_index(drop=True)
+    tagged["slice"] = pd.Categorical.from_codes(codes, categories=[s.name for s in slices])
+    return tagged
+
+@tracer.traced
+def aggregate_slice_sums(df: pd.DataFrame, slices: list[Slice]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Sums every slice for every year in one groupby, rather than filtering and
+    aggregating each slice/year separately.
+
+    INPUTS:
+        df: prepared data for all channels and years, with a 'channel' col
+        slices: the slices to report on
+
+    OUTPUT: (daily, weekly) long-format dataframes of summed metrics, keyed by
+    (slice, year, bf_date) and (slice, year, bf_week) respectively.
+
+    NB: weekly totals are rolled up from the daily sums, so they match
+    aggregate_by_week on the unaggregated data.
+    """
+    keys = ["year", "date", "bf_date", "bf_week"]
+    metrics = [c for c in df.select_dtypes("number").columns if c not in keys]
+    filters = [c for c in ["channel", "platform", "campaign_name"] if c in df]
+    tagged = tag_slices(df[keys + metrics + filters], slices)
+    daily = tagged.groupby(["slice", "year", "date", "bf_date", "bf_week"], as_index=False, observed=True)[metrics].sum()
+    return daily, roll_up_weeks(daily)
+
+def roll_up_weeks(daily: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sums long-format daily sums up to (slice, year, bf_week).
+    """
+    metrics = [c for c in daily.columns if c not in ["slice", "year", "date", "bf_date", "bf_week"]]
+    return daily.groupby(["slice", "year", "bf_week"], as_index=False, observed=True)[metrics].sum()
+
+def aggregate_slices(df: pd.DataFrame, slices: list[Slice], kpis: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Same as aggregate_slice_sums, with the given kpis calculated on both outputs.
+    """
+    daily, weekly = aggregate_slice_sums(df, slices)
+    return add_kpis(daily, kpis), add_kpis(weekly, kpis)
+
+@tracer.traced
+def load_sources(sources: list[tuple], workers: int = 1) -> pd.DataFrame:
+    """
+    Loads and prepares every source, tagged with its channel, into one dataframe.
+
+    With workers > 1, sources that aren't cached yet are parsed and prepared in
+    that many processes at once. Each worker writes its result to the columnar
+    cache, and the parent memory-maps the Arrow files instead of copying the
+    frames back through pickling.
+
+    NB: sources are (file name without .csv, prepare function, channel) tuples.
+    Without pyarrow there is no cache to hand frames over through, so sources
+    are always prepared one after another.
+    """
+    if workers > 1 and len(sources) > 1 and frame_cache.feather is not None:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sources))) as pool:
+            list(pool.map(cache_prepared, *zip(*[(df_name, prepare) for df_name, prepare, _ in sources])))
+    frames = []
+    for df_name, prepare, channel in sources:
+        df = load_prepared(df_name, prepare)
+        df["channel"] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [channel])
+        frames.append(df)
+    return concat_frames(frames)
+
+def concat_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    pd.concat that keeps categorical columns categorical.
+
+    NB: pd.concat turns categoricals whose categories differ into plain strings,
+    so each frame's copy of a column first gets the union of all their categories.
+    """
+    frames = list(frames)
+    for col in frames[0].columns:
+        if all(col in df and isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames):
+            categories = pd.api.types.union_categoricals([df[col] for df in frames]).categories
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+def make_sources(years) -> list[tuple]:
+    """
+    Gets the social and web sources for each of the given years, in the format
+    load_sources takes.
+    """
+    return [(f'{year}', prepare_df, 'social') for year in years] + \
+        [(f'{year}-web', prepare_web_df, 'web') for year in years]
 
-def get_sign(metric: float) -> str:
+@tracer.traced
+def update_store(sources: list[tuple], slices: list[Slice], store_path: str = STORE_PATH,
+                 workers: int = 1) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Gets the sign of the given metric and returns the appropriate prefix.
+    Brings the persisted daily/weekly slice sums up to date and returns them.
+
+    Only rows dated after the store's high-water mark for their channel and
+    year are aggregated. The new days are appended to the daily sums, and only
+    the (slice, year, bf_week) buckets they fall in are re-rolled in the weekly
+    sums. If there is no store yet, or the slices or sources have changed, it is
+    rebuilt from scratch, so a store never mixes data from two source sets.
+
+    NB: the store is append-only, so restated data for days already in the
+    store is not picked up - delete the store files to rebuild. The store is
+    kept as feather files, so this needs pyarrow.
 
-    NB: only returns '+' because the negative sign is stuck to neg values.
+    OUTPUT: (daily, weekly) sums in the same format as aggregate_slice_sums.
     """
-    if metric > 0:
-        sign = '+'
+    if frame_cache.feather is None:
+        raise RuntimeError("the incremental store is kept as feather files: install pyarrow, "
+                           "or run without --incremental")
+    meta_path = store_path + '.json'
+    source_names = [df_name for df_name, _, _ in sources]
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["slices"] != [list(s) for s in slices] or meta.get("sources") != source_names:
+            meta = None
+    high_water = {} if meta is None else meta["high_water"]
+
+    df = load_sources(sources, workers)
+    new = np.ones(len(df), dtype=bool)
+    for key, last_date in high_water.items():
+        channel, year = key.split("/")
+        new &= ~((df["channel"] == channel) & (df["year"] == int(year)) & (df["date"] <= last_date)).to_numpy(dtype=bool)
+    new_daily, new_weekly = aggregate_slice_sums(df[new], slices)
+    if meta is None:
+        daily, weekly = new_daily, new_weekly
     else:
-        sign = ''
-    return sign
+        daily = pd.concat([pd.read_feather(store_path + '.feather'), new_daily], ignore_index=True)
+        touched = new_weekly[["slice", "year", "bf_week"]]
+        weekly = pd.read_feather(store_path + '-weekly.feather')
+        weekly = weekly.merge(touched, how="left", indicator=True)
+        weekly = weekly[weekly["_merge"] == "left_only"].drop(columns=["_merge"])
+        touched_days = daily.merge(touched, how="inner")
+        weekly = pd.concat([weekly, roll_up_weeks(touched_days)], ignore_index=True)
+
+    # marks only ever move forward, whatever range of dates this run happened to load
+    for (channel, year), last_date in df.groupby(["channel", "year"], observed=True)["date"].max().items():
+        key = f"{channel}/{year}"
+        high_water[key] = max(high_water.get(key, ""), str(last_date.date()))
+    daily.to_feather(store_path + '.feather')
+    weekly.to_feather(store_path + '-weekly.feather')
+    with open(meta_path, "w") as f:
+        json.dump({"slices": [list(s) for s in slices], "sources": source_names, "high_water": high_water}, f, indent=2)
+    return daily, weekly
+
+# how actuals are formatted in the output; other kpis are left blank
+DOLLAR_KPIS = ['ROAS', 'CPV', 'AOV', 'CPM', 'CPC', 'spend']
+PERCENT_KPIS = ['CVR']
+
+@tracer.traced
+def compare_years(agg_df: pd.DataFrame, kpis: list[str], timeframe: str, periods: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Lines every row of an aggregate up with the same slice and bf_date/bf_week
+    the year before, in one merge, and calculates every kpi's YoY change.
+
+    INPUTS:
+        agg_df: long-format output of aggregate_slices (daily or weekly)
+        kpis: kpis to compare (must already be columns of agg_df)
+        timeframe: bf_date or bf_week
+        periods: optional dataframe of (year, timeframe) pairs to keep
+
+    OUTPUT: one row per (slice, year, timeframe) that has data this year, with
+    this year's kpis, last year's as '{kpi} LY' and the percent change as
+    '{kpi} YoY'. Daily aggregates keep their date column.
+
+    NB: like the old per-kpi comps, percent changes are truncated to whole
+    percents. They are NaN where last year is 0/inf/missing ("no data for last
+    year") or this year is 0/inf/missing ("no data for this year").
+    """
+    keys = ["slice", "year", timeframe]
+    current = agg_df
+    if periods is not None:
+        wanted = pd.MultiIndex.from_frame(periods[["year", timeframe]])
+        current = agg_df[pd.MultiIndex.from_frame(agg_df[["year", timeframe]]).isin(wanted)]
+    current = current[keys + (["date"] if "date" in agg_df else []) + kpis]
+    former = agg_df[keys + kpis].assign(year=agg_df["year"] + 1)
+    comp = current.merge(former, on=keys, how="left", suffixes=("", " LY"))
+
+    for kpi in kpis:
+        ty = comp[kpi].to_numpy(dtype=float)
+        ly = comp[f'{kpi} LY'].to_numpy(dtype=float)
+        valid = np.isfinite(ly) & (ly != 0) & np.isfinite(ty) & (ty != 0)
+        change = np.full(len(comp), np.nan)
+        np.divide((ty - ly) * 100, ly, out=change, where=valid)
+        comp[f'{kpi} YoY'] = np.trunc(change)
+    return comp.sort_values(keys, ignore_index=True)
+
+@tracer.traced
+def format_comparison(comp: pd.DataFrame, kpis: list[str], row_names) -> pd.DataFrame:
+    """
+    Formats the output of compare_years for the csvs and Slack message: '$' or
+    '%' actuals rounded to 2 places, and '+12% YoY'-style changes (or which year
+    has no data), one row per row name.
+    """
+    output_df = pd.DataFrame(index=pd.Index(row_names).rename(None))
+    for kpi in kpis:
+        ty = comp[kpi].to_numpy(dtype=float)
+        ly = comp[f'{kpi} LY'].to_numpy(dtype=float)
+        change = comp[f'{kpi} YoY'].to_numpy(dtype=float)
+
+        actual = ty.round(2).astype(str)
+        if kpi in DOLLAR_KPIS:
+            output_df[kpi] = np.char.add('$', actual)
+        elif kpi in PERCENT_KPIS:
+            output_df[kpi] = np.char.add(actual, '%')
+        else:
+            output_df[kpi] = ""
+
+        percent = np.where(np.isfinite(change), change, 0).astype(np.int64).astype(str)
+        text = np.char.add(np.char.add(np.where(change > 0, '+', ''), percent), '% YoY')
+        text = np.where(~np.isfinite(ty) | (ty == 0), "no data for this year", text)
+        text = np.where(~np.isfinite(ly) | (ly == 0), "no data for last year", text)
+        output_df[f'{kpi} YoY'] = text
+    return output_df
 
 def print_header(ty_date: datetime.date, ly_date: datetime.date, bf_date: int) -> None:
     """
@@ -199,155 +519,239 @@ def print_header(ty_date: datetime.date, ly_date: datetime.date, bf_date: int) -
     print(f"Reporting for {ty_date.strftime('%a')} {ty_date}, {abs(bf_date)} days {suffix} Black Friday.")
     print(f"(Comping with {ly_date.strftime('%a')} {ly_date})")
 
-def print_metrics(thisyear_df: pd.DataFrame, lastyear_df: pd.DataFrame, kpis: list[str], bf_date: int) -> None:
+def print_metrics(formatted: pd.Series, kpis: list[str]) -> None:
     """
     Prints metrics with YoY comps for the given KPIs. 
 
     INPUTS:
-        thisyear_df: dataframe representing the current year's data
-        lastyear_df: dataframe representing the last year's data
+        formatted: one row of format_comparison's output
         kpis: list of kpis (as strings with proper capitalization) to be printed
-        bf_date: int that represents the bf_date that metrics are wanted for (consistent across years)
 
-    OUTPUT: None, prints kpi metrics given for the given date
+    OUTPUT: None, prints kpi metrics given for the row's date
     """
-    thisyear_today = thisyear_df[thisyear_df['bf_date'] == bf_date]
-    lastyear_today = lastyear_df[lastyear_df['bf_date'] == bf_date]
-
     for kpi in kpis:
-        change = percent_change(thisyear_today[kpi].iloc[0], lastyear_today[kpi].iloc[0])
-        if kpi in ['ROAS', 'CPV', 'AOV', 'CPM', 'CPC', 'spend']:
-            print(f'{kpi} Actual ${thisyear_today[kpi].iloc[0].round(2)}, {get_sign(change)}{change}% YoY')
-        elif kpi in ['CVR']:
-            print(f'{kpi} Actual {thisyear_today[kpi].iloc[0].round(2)}%, {get_sign(change)}{change}% YoY')
-        else:
-            return ''
-        
-def make_metric_df(thisyear_df: pd.DataFrame, lastyear_df: pd.DataFrame, kpis: list[str], timeframe: str, bf_date_or_week: int, row_name: str) -> pd.DataFrame:
+        if kpi in DOLLAR_KPIS + PERCENT_KPIS:
+            print(f'{kpi} Actual {formatted[kpi]}, {formatted[f"{kpi} YoY"]}')
+
+@functools.lru_cache(maxsize=None)
+def load_promos(path: str = PROMOS_PATH) -> pd.DataFrame:
     """
-    Makes a dataframe including all kpis given for the given date, including cols
-    for actuals and YoY values. Requires a row name.
+    Loads the promo calendar once per run, sorted by start date.
 
-    NB: timeframe is bf_date or bf_week; choose O&OO as str 
+    NB: a missing promo file is treated as an empty calendar. A promo with no
+    end date runs indefinitely; promos with no start date, or that end before
+    they start, are skipped with a warning.
     """
-    output_df = pd.DataFrame()
-    for kpi in kpis:
-        output_df[kpi] = ""
-        output_df[f'{kpi} YoY'] = ""
-
-    if timeframe == "bf_date":
-        thisyear_data = thisyear_df[thisyear_df['bf_date'] == bf_date_or_week]
-        lastyear_data = lastyear_df[lastyear_df['bf_date'] == bf_date_or_week]
-    elif timeframe == "bf_week":
-        thisyear_data = thisyear_df[thisyear_df['bf_week'] == bf_date_or_week]
-        lastyear_data = lastyear_df[lastyear_df['bf_week'] == bf_date_or_week]
-    
-    for kpi in kpis:
-        change = percent_change(thisyear_data[kpi].iloc[0], lastyear_data[kpi].iloc[0])
-        if kpi in ['ROAS', 'CPV', 'AOV', 'CPM', 'CPC', 'spend']:
-            output_df.loc[row_name, kpi] = f'${thisyear_data[kpi].iloc[0].round(2)}'
-        elif kpi in ['CVR']:
-            output_df.loc[row_name, kpi] = f'{thisyear_data[kpi].iloc[0].round(2)}%'
-        output_df.loc[row_name, f'{kpi} YoY'] = f'{get_sign(change)}{change}% YoY'
+    if os.path.exists(path):
+        promo_df = pd.read_csv(
+            path,
+            parse_dates=["Start Date", "End Date"],
+            date_format="%m/%d/%y"
+        )
+    else:
+        promo_df = pd.DataFrame({
+            "Promo Name": pd.Series(dtype=str),
+            "Start Date": pd.Series(dtype="datetime64[ns]"),
+            "End Date": pd.Series(dtype="datetime64[ns]"),
+        })
+    promo_df["End Date"] = promo_df["End Date"].fillna(pd.Timestamp.max.normalize())
+    bad = promo_df["Start Date"].isna() | (promo_df["End Date"] < promo_df["Start Date"])
+    if bad.any():
+        warnings.warn(f"Skipping promos with a missing start date or an end date before it: "
+                      f"{promo_df.loc[bad, 'Promo Name'].tolist()}")
+        promo_df = promo_df[~bad]
+    return promo_df.sort_values(["Start Date", "End Date"], ignore_index=True)
+
+def promo_segments(promos: pd.DataFrame) -> tuple[np.ndarray, list[str]]:
+    """
+    Sweeps a calendar from load_promos into the date segments over which the set
+    of active promos doesn't change.
 
-    return output_df
+    OUTPUT: (bounds, labels), where bounds are the sorted datetime64[D] days a
+    segment starts on (every promo start, and every day after a promo end) and
+    labels[i] is the ', '-joined names of the promos active from bounds[i] up to
+    bounds[i + 1].
 
-def get_promos(date: datetime) -> None:
-    promo_df = pd.read_csv(
-        "promos.csv",
-        parse_dates=["Start Date", "End Date"],
-        date_format="%m/%d/%y"
-    )
-    active_promos = promo_df[(date >= promo_df["Start Date"].dt.date) & (date <= promo_df["End Date"].dt.date)]
+    NB: as the calendar is sorted by start date, the promos started by a bound
+    are the first searchsorted(starts, bound) of them, so only their end dates
+    need checking.
+    """
+    starts = promos["Start Date"].to_numpy(dtype="datetime64[D]")
+    ends = promos["End Date"].to_numpy(dtype="datetime64[D]") + np.timedelta64(1, "D")
+    bounds = np.unique(np.concatenate([starts, ends]))
+    started = np.searchsorted(starts, bounds, side="right")
+    names = promos["Promo Name"].to_numpy(dtype=object)
+    labels = [", ".join(names[:n][ends[:n] > bound]) for bound, n in zip(bounds, started)]
+    return bounds, labels
+
+def active_promos(dates, promos: pd.DataFrame | None = None) -> pd.Categorical:
+    """
+    Gets the names of the promos active on each of the given dates, joined
+    with ', ' ('' if there are none).
+
+    INPUTS:
+        dates: anything pd.DatetimeIndex accepts (a date column, a list of dates)
+        promos: a calendar from load_promos (defaults to promos.csv)
+
+    OUTPUT: a categorical with one entry per date.
+
+    NB: each date is placed in its promo_segments segment with one searchsorted,
+    so the cost follows the number of rows plus the size of the calendar, not
+    their product.
+    """
+    if promos is None:
+        promos = load_promos()
+    days = pd.DatetimeIndex(dates).to_numpy(dtype="datetime64[D]")
+    bounds, labels = promo_segments(promos)
+    # segment 0 is before the first promo starts
+    label_codes, categories = pd.factorize(np.array([""] + labels, dtype=object))
+    segments = np.searchsorted(bounds, days, side="right")
+    codes = np.where(np.isnat(days), -1, label_codes[segments])
+    return pd.Categorical.from_codes(codes, categories=categories).remove_unused_categories()
+
+@tracer.traced
+def add_promos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds a 'promos' column of the promos active on each row's date.
+    """
+    df["promos"] = active_promos(df["date"])
+    return df
+
+def get_promos(date: datetime.date) -> None:
+    promo_df = load_promos()
+    day = pd.Timestamp(date).normalize()
+    active_promos = promo_df[(promo_df["Start Date"] <= day) & (day <= promo_df["End Date"])]
     if not active_promos.empty: 
         print(f"Active promos on {date}: {active_promos['Promo Name'].tolist()}")
     else:
         print(f"No active promos on {date}.")
 
+@tracer.traced
+def backfill(daily_df: pd.DataFrame, weekly_df: pd.DataFrame, kpis: list[str],
+             start: datetime.date, end: datetime.date) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Makes the daily and weekly comp rows for every date from start to end
+    (inclusive) out of already-aggregated slices, instead of rerunning the
+    report once per day.
+
+    INPUTS:
+        daily_df, weekly_df: output of aggregate_slices (or update_store + add_kpis)
+        kpis: the kpis to report on
+        start, end: the date range, as datetime dates
+
+    OUTPUT: (daily, weekly) dataframes in the same format as full_metrics.csv
+    and full_metrics_weekly.csv, with one row per slice per date in the range
+    and one row per slice per bf_week it touches.
+
+    NB: each date is comped with the same bf_date in the year before its own.
+    Slice/dates with no data this year are skipped.
+
+    Also NB: weekly rows are for whole weeks, even where the range starts or
+    ends mid-week.
+    """
+    dates = add_bf_calendar(pd.DataFrame({"date": pd.date_range(start, end, freq="D")}))
+    daily = compare_years(daily_df, kpis, "bf_date", dates)
+    weekly = compare_years(weekly_df, kpis, "bf_week", dates.drop_duplicates(["year", "bf_week"]))
+    daily_names = daily["slice"].astype(str) + " (" + daily["date"].dt.strftime("%Y-%m-%d") + ")"
+    weekly_names = (weekly["slice"].astype(str) + " (" + weekly["year"].astype(str)
+                    + " week " + weekly["bf_week"].astype(str) + ")")
+    return format_comparison(daily, kpis, daily_names), format_comparison(weekly, kpis, weekly_names)
+
 # defaults to yesterday for data
 yesterday_bf_date = (yesterday.date() - black_friday(yesterday.year)).days
 yesterday_bf_week = get_bf_week(yesterday_bf_date)
 yesterday_lastyear = get_date_from_bf_date(lastyear, yesterday_bf_date)
 
-### Make dfs
-thisyear_df = prepare_df(load_df(f'{thisyear}'), thisyear)
-lastyear_df = prepare_df(load_df(f'{lastyear}'), lastyear)
-thisyear_web_df = prepare_web_df(load_df(f'{thisyear}-web'), thisyear)
-lastyear_web_df = prepare_web_df(load_df(f'{lastyear}-web'), lastyear)
-
-### ALLUP 
-thisyear_allup = aggregate_by_day(thisyear_df, kpis)
-lastyear_allup = aggregate_by_day(lastyear_df, kpis)
-thisyear_web_allup = aggregate_by_day(thisyear_web_df, kpis)
-lastyear_web_allup = aggregate_by_day(lastyear_web_df, kpis)
-thisyear_weekly_allup = aggregate_by_week(thisyear_df, kpis)
-lastyear_weekly_allup = aggregate_by_week(lastyear_df, kpis)
-thisyear_weekly_web_allup = aggregate_by_week(thisyear_web_df, kpis)
-lastyear_weekly_web_allup = aggregate_by_week(lastyear_web_df, kpis)
-
-### META
-thisyear_meta = filter_platform(thisyear_df, 'meta')
-lastyear_meta = filter_platform(lastyear_df, 'meta')
-thisyear_meta_dynamic = aggregate_by_day(filter_campaign(thisyear_meta, 'dynamic'), kpis)
-lastyear_meta_dynamic = aggregate_by_day(filter_campaign(lastyear_meta, 'dynamic'), kpis)
-thisyear_weekly_meta_dynamic = aggregate_by_week(filter_campaign(thisyear_meta, 'dynamic'), kpis)
-lastyear_weekly_meta_dynamic = aggregate_by_week(filter_campaign(lastyear_meta, 'dynamic'), kpis)
-thisyear_meta_promo = aggregate_by_day(filter_campaign(thisyear_meta, 'promo'), kpis)
-thisyear_weekly_meta_promo = aggregate_by_week(filter_campaign(thisyear_meta, 'promo'), kpis)
-if thisyear_meta_promo.empty:
-    pass
-else:
-    lastyear_meta_promo = aggregate_by_day(filter_campaign(lastyear_meta, 'promo'), kpis)
-    lastyear_weekly_meta_promo = aggregate_by_week(filter_campaign(lastyear_meta, 'promo'), kpis)
-
-## SLACK MESSAGE
-with open("slack_message.txt", "w") as f:
-    sys.stdout = f
-    print_header(yesterday.date(), yesterday_lastyear, yesterday_bf_date)
-    if yesterday.weekday() == 6:
-        print(' *Today is Monday!* Find data from last week <https://docs.google.com/spreadsheets/d/1Ahs7x0vivQktKV1pLOu5RwobhAIRBEfzQOTn7W1NHig/edit?gid=510339820#gid=510339820|here>.')
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Daily and weekly YoY comps on the Black Friday calendar.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"only aggregate days newer than the store in {STORE_PATH}.feather (needs pyarrow)")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"), type=datetime.date.fromisoformat,
+                        help="write comps for every date from START to END (YYYY-MM-DD) to backfill_metrics*.csv")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="prepare up to this many source files in parallel processes")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="time each stage, write the trace to PATH as JSON and print a summary")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --trace, also record each stage's peak allocations (slower)")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracer.enable(trace_memory=args.trace_memory)
     try:
-        print("\n *=== ALLUP SOCIAL COMMERCE ===* ")
-        print_metrics(thisyear_allup, lastyear_allup, topline_kpis, yesterday_bf_date)
-        print("\n *=== META DYNAMIC ===* ")
-        print_metrics(thisyear_meta_dynamic, lastyear_meta_dynamic, topline_kpis, yesterday_bf_date)
-        if thisyear_meta_promo.empty:
-            print("\nNo Meta Promo data from this year.")
-            get_promos(yesterday_lastyear)
-        else:
-            print("\n *=== META PROMO ===* ")
-            print_metrics(thisyear_meta_promo, lastyear_meta_promo, topline_kpis, yesterday_bf_date)
-            get_promos(yesterday)
-            get_promos(yesterday_lastyear)
-    except TypeError as e:
-        print(f"Unable to process - no data for yesterday {yesterday.date()}")
-sys.stdout = sys.__stdout__
-f.close()
-
-try:
-    ### OUTPUT CSV
-    allup_df = make_metric_df(thisyear_allup, lastyear_allup, kpis, "bf_date", yesterday_bf_date, f'ALLUP ({yesterday.date()})')
-    allup_web_df = make_metric_df(thisyear_web_allup, lastyear_web_allup, kpis, "bf_date", yesterday_bf_date, f'ALLUP - WEB ONLY ({yesterday.date()})')
-    merge0 = pd.concat([allup_df, allup_web_df])
-    meta_dynamic_df = make_metric_df(thisyear_meta_dynamic, lastyear_meta_dynamic, kpis, "bf_date", yesterday_bf_date, f'META DYNAMIC ({yesterday.date()})')
-    merge1 = pd.concat([merge0, meta_dynamic_df])
-    if thisyear_meta_promo.empty:
-        merge1.to_csv("full_metrics.csv", index=True)
+        run(args)
+    finally:
+        if args.trace:
+            tracer.write(args.trace)
+            print(tracer.summary(), file=sys.stderr)
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Runs the report for parsed command line arguments (see main).
+    """
+    ### Make dfs
+    if args.backfill:
+        start, end = args.backfill
+        sources = make_sources(range(start.year - 1, end.year + 1))
     else:
-        meta_promo_df = make_metric_df(thisyear_meta_promo, lastyear_meta_promo, kpis, "bf_date", yesterday_bf_date, f'META PROMO ({yesterday.date()})')
-        merge2 = pd.concat([merge1, meta_promo_df])
-        merge2.to_csv("full_metrics.csv", index=True)
-    ### WEEKLY 
-    allup_weekly_df = make_metric_df(thisyear_weekly_allup, lastyear_weekly_allup, kpis, "bf_week", yesterday_bf_week, f'ALLUP (last week)')
-    allup_weekly_web_df = make_metric_df(thisyear_weekly_web_allup, lastyear_weekly_web_allup, kpis, "bf_week", yesterday_bf_week, f'ALLUP - WEB ONLY (last week)')
-    merge0 = pd.concat([allup_weekly_df, allup_weekly_web_df])
-    meta_dynamic_weekly_df = make_metric_df(thisyear_weekly_meta_dynamic, lastyear_weekly_meta_dynamic, kpis, "bf_week", yesterday_bf_week, f'META DYNAMIC (last week)')
-    merge1weekly = pd.concat([merge0, meta_dynamic_weekly_df])
-    if thisyear_weekly_meta_promo.empty:
-        merge1weekly.to_csv("full_metrics_weekly.csv", index=True)
+        sources = make_sources([thisyear, lastyear])
+
+    ### SLICES
+    if args.incremental:
+        # backfills keep their own store, so they don't force a rebuild of the daily one
+        store_path = STORE_PATH + '-backfill' if args.backfill else STORE_PATH
+        daily_df, weekly_df = update_store(sources, slices, store_path, workers=args.workers)
+        daily_df, weekly_df = add_kpis(daily_df, kpis), add_kpis(weekly_df, kpis)
     else:
-        meta_promo_weekly_df = make_metric_df(thisyear_weekly_meta_promo, lastyear_weekly_meta_promo, kpis, "bf_week", yesterday_bf_week, f'META PROMO (last week)')
-        merge2weekly = pd.concat([merge1weekly, meta_promo_weekly_df])
-        merge2weekly.to_csv("full_metrics_weekly.csv", index=True)
-except TypeError as e:
-    print(f"Unable to process - no data for yesterday {yesterday.date()}")
+        daily_df, weekly_df = aggregate_slices(load_sources(sources, args.workers), slices, kpis)
+    daily_df = add_promos(daily_df)
+
+    if args.backfill:
+        backfill_df, backfill_weekly_df = backfill(daily_df, weekly_df, kpis, start, end)
+        with tracer.stage("write backfill csvs"):
+            backfill_df.to_csv("backfill_metrics.csv", index=True)
+            backfill_weekly_df.to_csv("backfill_metrics_weekly.csv", index=True)
+        return
+
+    ### COMPS
+    day = pd.DataFrame({"year": [thisyear], "bf_date": [yesterday_bf_date]})
+    week = pd.DataFrame({"year": [thisyear], "bf_week": [yesterday_bf_week]})
+    daily_comp = compare_years(daily_df, kpis, "bf_date", day)
+    weekly_comp = compare_years(weekly_df, kpis, "bf_week", week)
+    daily_metrics = format_comparison(daily_comp, kpis, daily_comp["slice"].astype(str))
+    weekly_metrics = format_comparison(weekly_comp, kpis, weekly_comp["slice"].astype(str))
+
+    ## SLACK MESSAGE
+    with tracer.stage("write slack message"), open("slack_message.txt", "w") as f:
+        sys.stdout = f
+        print_header(yesterday.date(), yesterday_lastyear, yesterday_bf_date)
+        if yesterday.weekday() == 6:
+            print(' *Today is Monday!* Find data from last week <https://docs.google.com/spreadsheets/d/1Ahs7x0vivQktKV1pLOu5RwobhAIRBEfzQOTn7W1NHig/edit?gid=510339820#gid=510339820|here>.')
+        if 'ALLUP' not in daily_metrics.index:
+            print(f"Unable to process - no data for yesterday {yesterday.date()}")
+        else:
+            print("\n *=== ALLUP SOCIAL COMMERCE ===* ")
+            print_metrics(daily_metrics.loc['ALLUP'], topline_kpis)
+            if 'META DYNAMIC' in daily_metrics.index:
+                print("\n *=== META DYNAMIC ===* ")
+                print_metrics(daily_metrics.loc['META DYNAMIC'], topline_kpis)
+            if 'META PROMO' not in daily_metrics.index:
+                print("\nNo Meta Promo data from this year.")
+                get_promos(yesterday_lastyear)
+            else:
+                print("\n *=== META PROMO ===* ")
+                print_metrics(daily_metrics.loc['META PROMO'], topline_kpis)
+                get_promos(yesterday.date())
+                get_promos(yesterday_lastyear)
+    sys.stdout = sys.__stdout__
+
+    ### OUTPUT CSV
+    with tracer.stage("write metrics csvs"):
+        daily_metrics.index = daily_metrics.index + f' ({yesterday.date()})'
+        daily_metrics.to_csv("full_metrics.csv", index=True)
+        ### WEEKLY 
+        weekly_metrics.index = weekly_metrics.index + ' (last week)'
+        weekly_metrics.to_csv("full_metrics_weekly.csv", index=True)
+
+if __name__ == "__main__":
+    main()
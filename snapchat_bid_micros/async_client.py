@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+
+from flask_server import TOKEN_URL, exchange_code_body, get_access_token, received_tokens, refresh_body
+from update_bid import ADS_API, MAX_BATCH_SIZE, chunked, record_put, set_bid, shared_scheduler
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+DEFAULT_CONCURRENCY = 64
+
+class AsyncAdsClient:
+    """
+    asyncio client for the Snapchat Ads API: token exchange/refresh, ad squad
+    reads and bulk ad squad updates. Ads API calls use the given token, or
+    flask_server's token manager's.
+
+    All requests share one keep-alive connection pool (HTTP/2 when h2 is
+    installed), at most `concurrency` are in flight at once, and every Ads API
+    call goes through the given RequestScheduler (by default the same one as
+    update_bid) for rate limiting and retries.
+
+    Use as `async with AsyncAdsClient() as client: ...`.
+    """
+    def __init__(self, token=None, api_base=ADS_API, concurrency=DEFAULT_CONCURRENCY, scheduler=None,
+                 token_url=TOKEN_URL):
+        self.api_base = api_base
+        self.token_url = token_url
+        self._token = token
+        self._scheduler = scheduler or shared_scheduler
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            http2=HTTP2,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=30,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    async def _request(self, method, url, **kwargs) -> httpx.Response:
+        # get_access_token may refresh synchronously, so keep it off the event loop
+        token = self._token or await asyncio.to_thread(get_access_token)
+        headers = {"Authorization": f"Bearer {token}", **kwargs.pop("headers", {})}
+        async with self._semaphore:
+            r = await self._scheduler.request_async(self._client, method, url, headers=headers, **kwargs)
+        r.raise_for_status()
+        return r
+
+    # Tokens (returned, not stored: hand them to flask_server.token_manager.set to use them process-wide)
+
+    async def _token_request(self, data) -> dict:
+        async with self._semaphore:
+            r = await self._client.post(self.token_url, data=data)
+        r.raise_for_status()
+        return r.json()
+
+    async def exchange_code(self, code) -> dict:
+        return received_tokens(await self._token_request(exchange_code_body(code)))
+
+    async def refresh_tokens(self, tokens) -> dict:
+        return received_tokens(await self._token_request(refresh_body(tokens)), tokens)
+
+    # Ad squads
+
+    async def get_adsquad(self, adsquad_id) -> dict:
+        r = await self._request("GET", f"{self.api_base}/adsquads/{adsquad_id}")
+        return r.json()["adsquads"][0]["adsquad"]
+
+    async def put_adsquads(self, campaign_id, adsquads) -> dict:
+        r = await self._request("PUT", f"{self.api_base}/campaigns/{campaign_id}/adsquads", json={"adsquads": adsquads})
+        return r.json()
+
+    async def update_adsquad_bid(self, adsquad_id, new_bid_usd, strategy="LOWEST_COST_WITH_MAX_BID") -> dict:
+        adsquad = set_bid(await self.get_adsquad(adsquad_id), new_bid_usd, strategy)
+        return await self.put_adsquads(adsquad["campaign_id"], [adsquad])
+
+    async def update_adsquad_bids(self, bids, strategy="LOWEST_COST_WITH_MAX_BID", max_batch_size=MAX_BATCH_SIZE):
+        """
+        Same as update_bid.update_adsquad_bids, with every GET and every
+        per-campaign PUT running concurrently on the event loop.
+        """
+        bids = dict(bids)
+        results, failures = {}, {}
+        adsquads = await asyncio.gather(*(self.get_adsquad(i) for i in bids), return_exceptions=True)
+        by_campaign = {}
+        for adsquad_id, adsquad in zip(bids, adsquads):
+            if isinstance(adsquad, Exception):
+                failures[adsquad_id] = adsquad
+                continue
+            adsquad = set_bid(adsquad, bids[adsquad_id], strategy)
+            by_campaign.setdefault(adsquad["campaign_id"], []).append(adsquad)
+
+        batches = [
+            (campaign_id, batch)
+            for campaign_id, campaign_adsquads in by_campaign.items()
+            for batch in chunked(campaign_adsquads, max_batch_size)
+        ]
+        responses = await asyncio.gather(*(self.put_adsquads(c, b) for c, b in batches), return_exceptions=True)
+        for (_, batch), response in zip(batches, responses):
+            record_put(batch, response, results, failures)
+        return results, failures
+
+async def _run(api_base, scheduler, method, *args, **kwargs):
+    async with AsyncAdsClient(api_base=api_base, scheduler=scheduler) as client:
+        return await getattr(client, method)(*args, **kwargs)
+
+def run_sync(method, *args, api_base=ADS_API, scheduler=None, **kwargs):
+    """
+    Runs one AsyncAdsClient method to completion from synchronous code,
+    e.g. run_sync("update_adsquad_bids", bids).
+
+    NB: this starts its own event loop, so it can't be called from code that is
+    already running in one; await the AsyncAdsClient method there instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_run(api_base, scheduler, method, *args, **kwargs))
+    raise RuntimeError(f"run_sync({method!r}) called from a running event loop; "
+                       f"await AsyncAdsClient.{method} instead")
@@ -0,0 +1,193 @@
+import argparse
+import os
+import sys
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from update_bid import ADS_API, DEFAULT_CONCURRENCY, SNAPSHOT_PATH, load_snapshot, sync_adsquad_bids
+
+# KPI math is shared with the reports (common/), so CPA/ROAS/CPM mean the same thing everywhere
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.kpi_registry import KPIS, evaluate_kpis
+
+PERFORMANCE_COLS = ["spend", "impressions", "orders", "demand"]
+BID_KPIS = ["CPM", "CPA", "ROAS"]
+
+class BidRules(NamedTuple):
+    """
+    How far and in which direction a repricing cycle may move each bid.
+
+    A squad's bid is scaled by how far it is from target (target_cpa / CPA, or
+    ROAS / target_roas; the lower of the two when both are set), limited to
+    max_step of the current bid per cycle, then held between floor and cap.
+
+    NB: squads that spent less than min_spend keep their bid, as do moves smaller
+    than min_change, so noise doesn't turn into API writes. Squads that spent
+    enough but have no orders/demand step down as far as max_step allows.
+    """
+    target_cpa: float | None = None
+    target_roas: float | None = None
+    floor: float = 0.10
+    cap: float = 50.0
+    max_step: float = 0.20
+    min_spend: float = 50.0
+    min_change: float = 0.01
+
+def summarize_performance(df: pd.DataFrame, bids: pd.Series | None = None) -> pd.DataFrame:
+    """
+    Sums performance rows (e.g. one per squad per day) to one row per ad squad.
+
+    INPUTS:
+        df: rows with adsquad_id, the PERFORMANCE_COLS, and optionally bid (current bid, USD)
+        bids: current bids by adsquad_id, used where df has no bid column
+
+    OUTPUT: dataframe indexed by adsquad_id with the summed columns and bid.
+    """
+    df = df.assign(adsquad_id=df["adsquad_id"].astype(str))
+    summed = df.groupby("adsquad_id", sort=False)[PERFORMANCE_COLS].sum()
+    if "bid" in df:
+        summed["bid"] = df.groupby("adsquad_id", sort=False)["bid"].last()
+    elif bids is not None:
+        summed["bid"] = bids.reindex(summed.index)
+    else:
+        raise ValueError("no current bids: add a bid column to the performance data or pass bids")
+    missing = summed.index[summed["bid"].isna()]
+    if len(missing):
+        raise ValueError(f"no current bid for ad squads: {', '.join(missing[:10])}"
+                         + (f" (and {len(missing) - 10} more)" if len(missing) > 10 else ""))
+    return summed
+
+def snapshot_bids(snapshot: dict) -> pd.Series:
+    # Current bids (USD) as last seen by sync_adsquad_bids
+    squads = snapshot["adsquads"]
+    return pd.Series({adsquad_id: squad["bid_micro"] / 1e6 for adsquad_id, squad in squads.items()
+                      if "bid_micro" in squad}, dtype=float)
+
+def compute_bids(perf: pd.DataFrame, rules: BidRules) -> pd.DataFrame:
+    """
+    Works out every squad's new bid from its performance in one array pass.
+
+    INPUTS:
+        perf: one row per ad squad, from summarize_performance
+        rules: targets, floor/cap and step limits
+
+    OUTPUT: perf with CPM, CPA and ROAS added, plus new_bid, change, change_pct
+    and rule (what decided the new bid: 'low spend', 'target',
+    'max step up'/'max step down', 'floor', 'cap' or 'below min change').
+    """
+    if rules.target_cpa is None and rules.target_roas is None:
+        raise ValueError("set target_cpa and/or target_roas")
+    plan = evaluate_kpis(perf.copy(), BID_KPIS, KPIS)
+    bid = plan["bid"].to_numpy(dtype=float)
+
+    # how far each squad is from target; >1 means it can afford a higher bid
+    factors = []
+    if rules.target_cpa is not None:
+        factors.append(rules.target_cpa / plan["CPA"].to_numpy())
+    if rules.target_roas is not None:
+        factors.append(plan["ROAS"].to_numpy() / rules.target_roas)
+    factor = np.fmin.reduce(factors) if len(factors) > 1 else factors[0]
+    # CPA is NaN for squads with spend but no orders; they're furthest from target
+    factor = np.where(np.isnan(factor), 0.0, factor)
+
+    target = bid * factor
+    low, high = bid * (1 - rules.max_step), bid * (1 + rules.max_step)
+    stepped = np.clip(target, low, high)
+    # whole cents, rounded towards the current bid so rounding never oversteps max_step
+    cents = np.round(np.clip(stepped, rules.floor, rules.cap) * 100, 6)
+    new_bid = np.where(cents > bid * 100, np.floor(cents), np.ceil(cents)) / 100
+
+    spend = plan["spend"].to_numpy(dtype=float)
+    low_spend = (spend < rules.min_spend) | (spend <= 0)
+    small = np.abs(new_bid - bid) < rules.min_change
+    new_bid = np.where(low_spend | small, bid, new_bid)
+
+    plan["new_bid"] = new_bid
+    plan["change"] = new_bid - bid
+    plan["change_pct"] = np.divide(new_bid - bid, bid, out=np.full(len(bid), np.nan), where=bid != 0) * 100
+    plan["rule"] = np.select(
+        [low_spend, small, stepped < rules.floor, stepped > rules.cap, target < low, target > high],
+        ["low spend", "below min change", "floor", "cap", "max step down", "max step up"],
+        default="target",
+    )
+    return plan
+
+def bid_sheet(plan: pd.DataFrame) -> list[tuple[str, float]]:
+    # (adsquad_id, new_bid_usd) pairs for the squads whose bid moves, as update_adsquad_bids takes them
+    changed = plan[plan["change"] != 0]
+    return list(zip(changed.index, changed["new_bid"].tolist()))
+
+def format_diff(plan: pd.DataFrame, limit: int | None = 50) -> str:
+    """
+    Dry-run report for a plan from compute_bids: how many squads each rule
+    decided, the total move up and down, and the biggest changes.
+    """
+    changed = plan[plan["change"] != 0]
+    up, down = changed[changed["change"] > 0], changed[changed["change"] < 0]
+    lines = [
+        f"{len(plan)} ad squads, {len(changed)} bids change "
+        f"({len(up)} up by ${up['change'].sum():.2f}, {len(down)} down by ${-down['change'].sum():.2f})",
+        "",
+        plan["rule"].value_counts().rename_axis("rule").rename("squads").to_string(),
+    ]
+    if len(changed):
+        cols = ["spend", "CPA", "ROAS", "bid", "new_bid", "change_pct", "rule"]
+        top = changed.reindex(changed["change_pct"].abs().sort_values(ascending=False, kind="stable").index)
+        if limit is not None and len(top) > limit:
+            lines += ["", f"Largest {limit} changes:"]
+            top = top.head(limit)
+        lines += ["", top[cols].round(2).to_string()]
+    return "\n".join(lines)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Reprice Snapchat ad squads from their performance.")
+    parser.add_argument("performance", help="csv with adsquad_id, spend, impressions, orders, demand (and bid)")
+    parser.add_argument("--target-cpa", type=float)
+    parser.add_argument("--target-roas", type=float)
+    defaults = BidRules()
+    parser.add_argument("--floor", type=float, default=defaults.floor, help="lowest bid, USD")
+    parser.add_argument("--cap", type=float, default=defaults.cap, help="highest bid, USD")
+    parser.add_argument("--max-step", type=float, default=defaults.max_step,
+                        help="largest move per cycle, as a fraction of the current bid")
+    parser.add_argument("--min-spend", type=float, default=defaults.min_spend,
+                        help="squads that spent less keep their bid")
+    parser.add_argument("--min-change", type=float, default=defaults.min_change,
+                        help="smaller moves aren't written, USD")
+    parser.add_argument("--dry-run", action="store_true", help="print the diff report without pushing any bids")
+    parser.add_argument("--sheet", metavar="PATH", help="also write the new bid sheet to PATH as csv")
+    parser.add_argument("--ad-account-id", help="ad account whose squads are synced")
+    parser.add_argument("--campaign-id", action="append", default=[], help="campaign whose squads are synced")
+    parser.add_argument("--strategy", default="LOWEST_COST_WITH_MAX_BID")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--api-base", default=ADS_API)
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH,
+                        help="ad squad snapshot to take current bids from when the csv has no bid column")
+    args = parser.parse_args(argv)
+    if args.target_cpa is None and args.target_roas is None:
+        parser.error("set --target-cpa and/or --target-roas")
+    if not args.dry_run and not args.ad_account_id and not args.campaign_id:
+        parser.error("pushing bids needs --ad-account-id or --campaign-id (or use --dry-run)")
+
+    rules = BidRules(args.target_cpa, args.target_roas, args.floor, args.cap, args.max_step,
+                     args.min_spend, args.min_change)
+    df = pd.read_csv(args.performance, dtype={"adsquad_id": str})
+    bids = None if "bid" in df else snapshot_bids(load_snapshot(args.snapshot))
+    plan = compute_bids(summarize_performance(df, bids), rules)
+    print(format_diff(plan))
+
+    sheet = bid_sheet(plan)
+    if args.sheet:
+        pd.DataFrame(sheet, columns=["adsquad_id", "bid"]).to_csv(args.sheet, index=False)
+    if args.dry_run or not sheet:
+        return
+    results, failures, unchanged = sync_adsquad_bids(sheet, args.ad_account_id, args.campaign_id, args.strategy,
+                                                     args.concurrency, api_base=args.api_base,
+                                                     snapshot_path=args.snapshot)
+    print(f"\n{len(results)} bids updated, {len(unchanged)} already set, {len(failures)} failed")
+    for adsquad_id, error in failures.items():
+        print(f"  {adsquad_id}: {error}")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import os, json, secrets, urllib.parse, time
+import os, json, secrets, urllib.parse, time, threading
 from flask import Flask, redirect, request, session, url_for
 import requests
 from dotenv import load_dotenv
@@ -11,13 +11,20 @@ SCOPE = "snapchat-marketing-api"
 AUTH_URL = "https://accounts.snapchat.com/login/oauth2/authorize"
 TOKEN_URL = "https://accounts.snapchat.com/login/oauth2/access_token"
 TOKENS_PATH = "snap_tokens.json"
+EXPIRY_MARGIN = 60  # tokens this close to expiry are refreshed before use
+REFRESH_AHEAD = 300  # background refresh starts this long before expiry (at most half the token's lifetime)
+MIN_REFRESH_DELAY = 5  # never re-arm the background refresh sooner than this
+REFRESH_RETRY = 30  # a failed background refresh is retried after this long
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET", secrets.token_hex(16))
 
 def save_tokens(data):
-    with open(TOKENS_PATH, "w") as f:
+    # Write then rename, so readers never see a half-written file
+    tmp_path = TOKENS_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(data, f, indent=2)
+    os.replace(tmp_path, TOKENS_PATH)
 
 def load_tokens():
     if not os.path.exists(TOKENS_PATH):
@@ -51,40 +58,119 @@ def callback():
     if not code:
         return "Missing code", 400
 
-    data = {
+    resp = requests.post(TOKEN_URL, data=exchange_code_body(code), timeout=30)
+    resp.raise_for_status()
+    token_manager.set(received_tokens(resp.json()))
+    return "Tokens saved. You can close this tab."
+
+# Token endpoint form bodies and response handling, shared with async_client
+
+def exchange_code_body(code):
+    return {
         "grant_type": "authorization_code",
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
         "code": code,
         "redirect_uri": REDIRECT_URI,  # must match
     }
-    resp = requests.post(TOKEN_URL, data=data, timeout=30)
-    resp.raise_for_status()
-    tokens = resp.json()
-    tokens["obtained_at"] = int(time.time())
-    save_tokens(tokens)
-    return "Tokens saved. You can close this tab."
+
+def refresh_body(tokens):
+    return {
+        "grant_type": "refresh_token",
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET,
+        "refresh_token": tokens["refresh_token"],
+    }
+
+def received_tokens(new_tokens, old_tokens=None):
+    # Stamps when the tokens were issued, and keeps the old refresh token if the
+    # endpoint didn't send a new one
+    if old_tokens is not None:
+        new_tokens["refresh_token"] = new_tokens.get("refresh_token", old_tokens["refresh_token"])
+    new_tokens["obtained_at"] = int(time.time())
+    return new_tokens
+
+def refresh_tokens(tokens, token_url=TOKEN_URL):
+    r = requests.post(token_url, data=refresh_body(tokens), timeout=30)
+    r.raise_for_status()
+    return received_tokens(r.json(), tokens)
+
+def expires_at(tokens):
+    return tokens.get("obtained_at", 0) + tokens.get("expires_in", 3600)
+
+def refresh_lead(tokens):
+    # Short-lived tokens get refreshed halfway through their life rather than
+    # REFRESH_AHEAD before expiry, which could be before they were even issued
+    return min(REFRESH_AHEAD, tokens.get("expires_in", 3600) / 2)
+
+class TokenManager:
+    """
+    Keeps the access token in memory for the whole process.
+
+    A background timer refreshes it REFRESH_AHEAD seconds before it expires
+    (or halfway through its life, for short-lived tokens), retrying after
+    REFRESH_RETRY seconds if that fails.
+    If a caller still finds it within EXPIRY_MARGIN of expiry, it refreshes
+    synchronously; concurrent callers wait on the same refresh rather than each
+    hitting the token endpoint.
+    """
+    def __init__(self):
+        self._tokens = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def get(self):
+        tokens = self._tokens
+        if tokens is None or time.time() > expires_at(tokens) - EXPIRY_MARGIN:
+            tokens = self._refresh(EXPIRY_MARGIN)
+        return tokens["access_token"]
+
+    def set(self, tokens):
+        with self._lock:
+            self._store(tokens, save=True)
+
+    def _refresh(self, margin):
+        # Refreshes unless the token (possibly just refreshed by another caller)
+        # is further than margin seconds from expiry
+        with self._lock:
+            tokens = self._tokens
+            if tokens is None:
+                tokens = load_tokens()
+                if not tokens:
+                    raise RuntimeError("No tokens.json — hit /login first.")
+                self._store(tokens, save=False)
+            if time.time() > expires_at(tokens) - margin:
+                tokens = refresh_tokens(tokens)
+                self._store(tokens, save=True)
+            return tokens
+
+    def _store(self, tokens, save):
+        if save:
+            save_tokens(tokens)
+        self._tokens = tokens
+        self._schedule(expires_at(tokens) - refresh_lead(tokens) - time.time())
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, MIN_REFRESH_DELAY), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh(refresh_lead(self._tokens))
+        except Exception as e:
+            # Try again shortly; callers still fall back to a synchronous refresh
+            # once the token is near expiry
+            app.logger.warning("Background token refresh failed: %s", e)
+            with self._lock:
+                self._schedule(REFRESH_RETRY)
+
+token_manager = TokenManager()
 
 def get_access_token():
-    tokens = load_tokens()
-    if not tokens:
-        raise RuntimeError("No tokens.json — hit /login first.")
-    # Refresh if near expiry
-    if int(time.time()) - tokens.get("obtained_at", 0) > (tokens.get("expires_in", 3600) - 60):
-        data = {
-            "grant_type": "refresh_token",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "refresh_token": tokens["refresh_token"],
-        }
-        r = requests.post(TOKEN_URL, data=data, timeout=30)
-        r.raise_for_status()
-        new_tokens = r.json()
-        new_tokens["refresh_token"] = new_tokens.get("refresh_token", tokens["refresh_token"])
-        new_tokens["obtained_at"] = int(time.time())
-        save_tokens(new_tokens)
-        tokens = new_tokens
-    return tokens["access_token"]
+    return token_manager.get()
 
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
@@ -0,0 +1,216 @@
+import asyncio
+import contextlib
+import random
+import re
+import threading
+import time
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+import requests
+
+try:
+    import httpx
+except ImportError:  # only needed by request_async
+    httpx = None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter whose rate adapts to the API.
+
+    A 429 halves the rate (at most once per second, so one burst of 429s counts
+    once) and pauses every caller until Retry-After has passed; each success then
+    nudges the rate back up by about `recovery` requests/second per second, up
+    to max_rate.
+    """
+    def __init__(self, rate=10.0, max_rate=50.0, min_rate=0.5, recovery=1.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while (wait := self._try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self._try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def _try_acquire(self) -> float:
+        # Takes a token and returns 0, or returns how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, max(self.rate, 1.0))
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_cut >= 1:
+                self.rate = max(self.rate / 2, self.min_rate)
+                self._last_cut = now
+            self._tokens = 0.0
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            self._updated = max(self._updated, self._paused_until)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.rate + self.recovery / self.rate, self.max_rate)
+
+class RequestScheduler:
+    """
+    Sends every Ads API request through one rate limiter, optionally a bounded
+    window of in-flight requests (max_in_flight=None leaves that to the caller),
+    and a retry policy.
+
+    429s and 5xx/connection errors are retried up to max_retries times, waiting
+    for Retry-After when the API sends one and exponential backoff with full
+    jitter otherwise. Latency and outcome are recorded per endpoint; see metrics().
+    """
+    def __init__(self, rate=10.0, max_rate=50.0, max_in_flight=None, max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.bucket = TokenBucket(rate=rate, max_rate=max_rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else contextlib.nullcontext()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def request(self, session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Like session.request, but rate limited and retried. Non-retryable error
+        responses are returned as-is for the caller to raise_for_status.
+        """
+        endpoint = endpoint_name(method, url)
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            with self._in_flight:
+                try:
+                    r = session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    self._record(endpoint, time.perf_counter() - start, "error", attempt)
+                    if attempt == self.max_retries:
+                        raise
+                    time.sleep(self._backoff(attempt))
+                    continue
+            elapsed = time.perf_counter() - start
+
+            if r.status_code not in RETRY_STATUSES:
+                self.bucket.succeeded()
+                self._record(endpoint, elapsed, "ok" if r.ok or r.status_code == 304 else "error", attempt)
+                return r
+
+            retry_after = parse_retry_after(r.headers.get("Retry-After"))
+            if r.status_code == 429:
+                self.bucket.throttled(retry_after)
+            self._record(endpoint, elapsed, "throttled" if r.status_code == 429 else "error", attempt)
+            if attempt == self.max_retries:
+                return r
+            time.sleep(retry_after if retry_after is not None else self._backoff(attempt))
+        return r
+
+    async def request_async(self, client, method: str, url: str, **kwargs):
+        """
+        request() for an httpx.AsyncClient: same limiter, retries and metrics,
+        but waits with asyncio.sleep. The caller bounds how many are in flight.
+        """
+        endpoint = endpoint_name(method, url)
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self._record(endpoint, time.perf_counter() - start, "error", attempt)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            elapsed = time.perf_counter() - start
+
+            if r.status_code not in RETRY_STATUSES:
+                self.bucket.succeeded()
+                self._record(endpoint, elapsed, "ok" if r.is_success or r.status_code == 304 else "error", attempt)
+                return r
+
+            retry_after = parse_retry_after(r.headers.get("Retry-After"))
+            if r.status_code == 429:
+                self.bucket.throttled(retry_after)
+            self._record(endpoint, elapsed, "throttled" if r.status_code == 429 else "error", attempt)
+            if attempt == self.max_retries:
+                return r
+            await asyncio.sleep(retry_after if retry_after is not None else self._backoff(attempt))
+        return r
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _record(self, endpoint, elapsed, outcome, attempt):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {
+                "latencies": [], "ok": 0, "error": 0, "throttled": 0, "retries": 0,
+                "first": time.monotonic(), "last": 0.0,
+            })
+            stats["latencies"].append(elapsed)
+            stats[outcome] += 1
+            stats["retries"] += attempt > 0
+            stats["last"] = time.monotonic()
+
+    def metrics(self) -> dict:
+        """
+        The limiter's current rate, plus per-endpoint request counts by outcome,
+        retries, latency (mean/p50/p95/max in ms) and throughput in requests/second.
+        """
+        endpoints = {}
+        with self._stats_lock:
+            for endpoint, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                n = len(latencies)
+                window = max(stats["last"] - stats["first"], latencies[-1])
+                endpoints[endpoint] = {
+                    "requests": n,
+                    "ok": stats["ok"],
+                    "error": stats["error"],
+                    "throttled": stats["throttled"],
+                    "retries": stats["retries"],
+                    "mean_ms": 1000 * sum(latencies) / n,
+                    "p50_ms": 1000 * latencies[n // 2],
+                    "p95_ms": 1000 * latencies[min(int(n * 0.95), n - 1)],
+                    "max_ms": 1000 * latencies[-1],
+                    "per_second": n / window if window else float(n),
+                }
+        return {"rate": self.bucket.rate, "endpoints": endpoints}
+
+def endpoint_name(method: str, url: str) -> str:
+    # e.g. "GET /v1/adsquads/{id}", so every ad squad shares one set of stats
+    path = urllib.parse.urlsplit(url).path
+    path = re.sub(r"/(adaccounts|campaigns|adsquads|ads|creatives)/[^/]+", r"/\1/{id}", path)
+    return f"{method} {path}"
+
+def parse_retry_after(value) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
@@ -1,28 +1,245 @@
+import json
+import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from requests.adapters import HTTPAdapter
+from flask_server import get_access_token
+from scheduler import RequestScheduler
 
 ADS_API = "https://adsapi.snapchat.com/v1"
+DEFAULT_CONCURRENCY = 8
+MAX_BATCH_SIZE = 50  # ad squads per PUT
+PAGE_LIMIT = 1000  # ad squads per page when listing
+SNAPSHOT_PATH = "adsquad_snapshot.json"
+
+# Every Ads API call goes through this unless a caller passes its own scheduler, so
+# one rate limit covers the whole process. How many requests are in flight is left
+# to each caller's worker pool, which is sized from its concurrency argument.
+shared_scheduler = RequestScheduler()
 
 def usd_to_micro(usd: str | float) -> int:
     # Use Decimal to avoid float rounding issues
     return int((Decimal(str(usd)) * Decimal(1_000_000)).to_integral_value())
 
-def update_adsquad_bid(adsquad_id: str, new_bid_usd: float, strategy="LOWEST_COST_WITH_MAX_BID"):
-    token = get_access_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+def make_session(token: str, pool_size: int = DEFAULT_CONCURRENCY) -> requests.Session:
+    # One keep-alive pool shared by every request, sized to the concurrency limit
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+    return session
+
+def get_adsquad(session: requests.Session, adsquad_id: str, api_base: str = ADS_API,
+                scheduler: RequestScheduler | None = None) -> dict:
+    r = (scheduler or shared_scheduler).request(session, "GET", f"{api_base}/adsquads/{adsquad_id}", timeout=30)
+    r.raise_for_status()
+    return r.json()["adsquads"][0]["adsquad"]
 
-    # 1) Get current ad squad
-    r = requests.get(f"{ADS_API}/adsquads/{adsquad_id}", headers=headers, timeout=30)
+def put_adsquads(session: requests.Session, campaign_id: str, adsquads: list[dict], api_base: str = ADS_API,
+                 scheduler: RequestScheduler | None = None) -> dict:
+    # The campaign endpoint takes full ad squad objects, any number per request
+    r = (scheduler or shared_scheduler).request(session, "PUT", f"{api_base}/campaigns/{campaign_id}/adsquads",
+                                                json={"adsquads": adsquads}, timeout=30)
     r.raise_for_status()
-    adsquad = r.json()["adsquads"][0]["adsquad"]
+    return r.json()
 
-    # 2) Modify bid fields (and anything else you need)
+def set_bid(adsquad: dict, new_bid_usd: float, strategy: str) -> dict:
+    # Modify bid fields (and anything else you need)
     adsquad["bid_micro"] = usd_to_micro(new_bid_usd)
     adsquad["bid_strategy"] = strategy  # e.g., LOWEST_COST_WITH_MAX_BID or TARGET_COST
+    return adsquad
+
+def record_put(batch: list[dict], response, results: dict, failures: dict):
+    # A failed PUT (response is the exception) fails every squad in its batch;
+    # otherwise each squad gets the sub-response carrying its id or, for those
+    # without one, the sub-response in the position it was sent in. A squad
+    # left without a sub-response counts as failed.
+    if isinstance(response, Exception):
+        for adsquad in batch:
+            failures[adsquad["id"]] = response
+        return
+    subs = response.get("adsquads", [])
+    by_id = {sub["adsquad"]["id"]: sub for sub in subs if sub.get("adsquad", {}).get("id")}
+    for i, adsquad in enumerate(batch):
+        sub = by_id.get(adsquad["id"])
+        if sub is None and i < len(subs) and not subs[i].get("adsquad", {}).get("id"):
+            sub = subs[i]
+        if sub is None:
+            failures[adsquad["id"]] = RuntimeError(f"no sub-response for ad squad {adsquad['id']}")
+        elif sub.get("sub_request_status", "SUCCESS") == "SUCCESS":
+            results[adsquad["id"]] = sub
+        else:
+            failures[adsquad["id"]] = RuntimeError(sub.get("sub_request_error_reason", sub))
+
+def update_adsquad_bid(adsquad_id: str, new_bid_usd: float, strategy="LOWEST_COST_WITH_MAX_BID", api_base=ADS_API,
+                       scheduler=None):
+    # Thin sync wrapper: GET the current ad squad, then PUT the full object back
+    # through the campaign endpoint, on the async client (not callable from
+    # inside a running event loop; see async_client.run_sync)
+    from async_client import run_sync  # async_client imports this module
+    return run_sync("update_adsquad_bid", adsquad_id, new_bid_usd, strategy, api_base=api_base, scheduler=scheduler)
+
+def update_adsquad_bids(bids, strategy="LOWEST_COST_WITH_MAX_BID", concurrency=DEFAULT_CONCURRENCY,
+                        max_batch_size=MAX_BATCH_SIZE, api_base=ADS_API, scheduler=None):
+    """
+    Updates many ad squad bids over one pooled session and token.
+
+    The current ad squads are fetched concurrently, then the modified squads are
+    grouped by campaign and sent back in one PUT per campaign (split into chunks
+    of at most max_batch_size), also concurrently.
+
+    bids: iterable of (adsquad_id, new_bid_usd) pairs
+    scheduler: RequestScheduler to send requests through (default: shared_scheduler)
+    Returns (results, failures): dicts keyed by adsquad_id holding that squad's
+    entry from the PUT response, or the error its GET/PUT failed with.
+    """
+    bids = dict(bids)
+    results, failures = {}, {}
+    with make_session(get_access_token(), pool_size=concurrency) as session, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # 1) Get current ad squads
+        gets = {adsquad_id: pool.submit(get_adsquad, session, adsquad_id, api_base, scheduler) for adsquad_id in bids}
+        by_campaign = {}
+        for adsquad_id, future in gets.items():
+            try:
+                adsquad = set_bid(future.result(), bids[adsquad_id], strategy)
+            except Exception as e:
+                failures[adsquad_id] = e
+                continue
+            by_campaign.setdefault(adsquad["campaign_id"], []).append(adsquad)
+
+        # 2) PUT each campaign's squads back in batches
+        put_results, put_failures = put_grouped(session, pool, by_campaign, max_batch_size, api_base, scheduler)
+    results.update(put_results)
+    failures.update(put_failures)
+    return results, failures
+
+def put_grouped(session: requests.Session, pool: ThreadPoolExecutor, by_campaign: dict[str, list[dict]],
+                max_batch_size=MAX_BATCH_SIZE, api_base=ADS_API, scheduler=None):
+    """
+    PUTs each campaign's modified ad squads in batches of at most max_batch_size,
+    concurrently on the given pool.
+
+    Returns (results, failures) keyed by ad squad id. A failed PUT fails every
+    squad in its batch; otherwise each squad's sub_request_status decides.
+    """
+    results, failures = {}, {}
+    puts = [
+        (batch, pool.submit(put_adsquads, session, campaign_id, batch, api_base, scheduler))
+        for campaign_id, adsquads in by_campaign.items()
+        for batch in chunked(adsquads, max_batch_size)
+    ]
+    for batch, future in puts:
+        try:
+            response = future.result()
+        except Exception as e:
+            response = e
+        record_put(batch, response, results, failures)
+    return results, failures
+
+def chunked(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def load_snapshot(path=SNAPSHOT_PATH) -> dict:
+    if not os.path.exists(path):
+        return {"pages": {}, "adsquads": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_snapshot(snapshot: dict, path=SNAPSHOT_PATH):
+    # Write then rename, so an interrupted run never leaves a half-written snapshot
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def remember_adsquad(snapshot: dict, adsquad: dict):
+    # Keep whichever copy is newest, so a lagging list read can't undo a PUT we just made
+    cached = snapshot["adsquads"].get(adsquad["id"])
+    if cached is None or adsquad.get("updated_at", "") >= cached.get("updated_at", ""):
+        snapshot["adsquads"][adsquad["id"]] = adsquad
+
+def list_adsquads(session: requests.Session, parent_url: str, snapshot: dict,
+                  scheduler: RequestScheduler | None = None) -> list[str]:
+    """
+    Lists every ad squad under a campaign or ad account, following next_link
+    pagination, and records them in the snapshot.
+
+    Each page's ETag is kept in the snapshot; a page that comes back 304 Not
+    Modified is served from the snapshot instead.
+    Returns the ad squad ids found.
+    """
+    ids = []
+    url = f"{parent_url}/adsquads?limit={PAGE_LIMIT}"
+    while url:
+        cached = snapshot["pages"].get(url)
+        headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+        r = (scheduler or shared_scheduler).request(session, "GET", url, headers=headers, timeout=30)
+        if r.status_code == 304:
+            page_ids, next_url = cached["ids"], cached["next"]
+        else:
+            r.raise_for_status()
+            body = r.json()
+            page_ids = []
+            for item in body.get("adsquads", []):
+                remember_adsquad(snapshot, item["adsquad"])
+                page_ids.append(item["adsquad"]["id"])
+            next_url = body.get("paging", {}).get("next_link")
+            snapshot["pages"][url] = {"etag": r.headers.get("ETag"), "ids": page_ids, "next": next_url}
+        ids += page_ids
+        url = next_url
+    return ids
+
+def sync_adsquad_bids(bids, ad_account_id=None, campaign_ids=(), strategy="LOWEST_COST_WITH_MAX_BID",
+                      concurrency=DEFAULT_CONCURRENCY, max_batch_size=MAX_BATCH_SIZE, api_base=ADS_API,
+                      snapshot_path=SNAPSHOT_PATH, scheduler=None):
+    """
+    Brings ad squad bids in line with a bid sheet, writing only the squads whose
+    bid_micro or bid_strategy actually differ from it.
+
+    Current state comes from the ad account's (or the given campaigns') ad squad
+    list endpoints rather than one GET per squad, and is kept in a local snapshot
+    between runs.
+
+    bids: iterable of (adsquad_id, new_bid_usd) pairs
+    scheduler: as in update_adsquad_bids
+    Returns (results, failures, unchanged): results/failures as in
+    update_adsquad_bids, plus the ids that already had the right bid.
+    """
+    bids = dict(bids)
+    parents = [f"{api_base}/campaigns/{c}" for c in campaign_ids]
+    if ad_account_id:
+        parents.append(f"{api_base}/adaccounts/{ad_account_id}")
+    if not parents:
+        raise ValueError("sync_adsquad_bids needs an ad_account_id or campaign_ids to list ad squads from")
+    snapshot = load_snapshot(snapshot_path)
+    results, failures, unchanged = {}, {}, []
+    with make_session(get_access_token(), pool_size=concurrency) as session, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # 1) Load current state in bulk
+        listed = set()
+        for ids in pool.map(lambda parent: list_adsquads(session, parent, snapshot, scheduler), parents):
+            listed.update(ids)
+
+        # 2) Diff against the sheet
+        by_campaign = {}
+        for adsquad_id, bid in bids.items():
+            if adsquad_id not in listed:
+                failures[adsquad_id] = KeyError(f"ad squad {adsquad_id} not found under {parents}")
+                continue
+            adsquad = snapshot["adsquads"][adsquad_id]
+            if adsquad.get("bid_micro") == usd_to_micro(bid) and adsquad.get("bid_strategy") == strategy:
+                unchanged.append(adsquad_id)
+                continue
+            by_campaign.setdefault(adsquad["campaign_id"], []).append(set_bid(dict(adsquad), bid, strategy))
 
-    # 3) PUT full object back through the campaign endpoint
-    campaign_id = adsquad["campaign_id"]
-    payload = {"adsquads": [adsquad]}
-    r2 = requests.put(f"{ADS_API}/campaigns/{campaign_id}/adsquads", json=payload, headers=headers, timeout=30)
-    r2.raise_for_status()
-    return r2.json()
+        # 3) Write only what changed
+        results, put_failures = put_grouped(session, pool, by_campaign, max_batch_size, api_base, scheduler)
+        failures.update(put_failures)
+    for sub in results.values():
+        if "adsquad" in sub:
+            remember_adsquad(snapshot, sub["adsquad"])
+    save_snapshot(snapshot, snapshot_path)
+    return results, failures, unchanged